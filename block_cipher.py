@@ -1,5 +1,7 @@
+from functools import partial
+from multiprocessing import Pool
 
-from random import randint
+from key_material import random_bytes
 
 def gen_bytevals(n):
     """
@@ -8,7 +10,7 @@ def gen_bytevals(n):
     returns a list of n ints, where each int is in the range 0->255 inclusive
 
     """
-    vals = [randint(0, 255) for i in range(n) ]
+    vals = list( random_bytes(n) )  # from the OS secure generator, not randint
     return vals
 
 def encrypt(s, k):
@@ -109,46 +111,103 @@ def pkcs5_pad(s, b):
     return s
 
 
-def encrypt_2n(s, k):
+## the 2n block functions below work on whole messages at once rather than
+## a block at a time: the XORs are done on the message as one big int, and
+## blocks are moved in and out of place with one strided slice per key
+## position, so there is no python loop over the blocks or the bytes
+
+def xor_vals(*bufs):
+    """
+    bufs are equal length bytes objects (or lists of ints in range 0->255)
+    returns a bytes object, the bytewise XOR of all of them
+    """
+    n = len(bufs[0])
+    x = 0
+    for buf in bufs:
+        assert len(buf) == n
+        x ^= int.from_bytes(bytes(buf), 'big')
+    return x.to_bytes(n, 'big')
+
+def encrypt_padded(m, k):
+    """
+    m is a bytes object, a whole number of blocks of padded message
+    k is a list of ints, the keybytes to use for encryption
+
+    returns a bytes object, r then r XOR k XOR m for each block
+    """
+    b = len(k)  # get the block length 
+    n = len(m)
+    assert n % b == 0
+
+    r = random_bytes(n)   # all the blocks' r in one go
+    c2 = xor_vals(r, bytes(k)*(n//b), m)
+
+    ## interleave into r block, c2 block, r block, c2 block ...
+    ciphervals = bytearray(2*n)
+    for i in range(b):
+        ciphervals[i::2*b] = r[i::b]
+        ciphervals[b+i::2*b] = c2[i::b]
+
+    return bytes(ciphervals)
+
+def encrypt_2n(s, k, processes=1, shardsize=2**22):
     """ 
-    s is a string, the  message to encrypt.
+    s is a string, the  message to encrypt (or a bytes object)
     k is a list of ints, the keybytes to use for encryption
+    processes is the number of worker processes to encrypt on
+    (default 1 encrypts in this process, None is one per cpu)
+    shardsize is roughly the number of message bytes given to a worker at a time
+
+    pads s to a multiple of the keylength, then encrypts each 
+    keylength chunk with the 2n block cipher
 
-    breaks up the message s into chunks equal to the keylength
-    and encrypts each with the 2n block cipher
+    no block depends on any other (each has its own r), so for 
+    processes != 1 the message is cut into shards of whole blocks that 
+    are encrypted in parallel and joined back in order
 
-    returns a list of ints, the concatenated result 
+    returns a bytes object, the concatenated result
+    (r then r XOR k XOR m for each block, as encrypt gives)
 
     """
     b = len(k)  # get the block length 
 
-    s = pkcs5_pad(s, b)  # pads the string so len(s) is a multiple of b
+    if isinstance(s, str):
+        s = s.encode('latin-1')   # chars 0->255 to the same byte values
 
-    chunks = chunk(s, b)   # split s into b-length chunks
+    p = b - len(s)%b   # pkcs5 padding, as pkcs5_pad
+    m = s + bytes([p])*p
 
-    #key = gen_bytevals(n)  # generate n-length key
+    shardsize = max(shardsize - shardsize%b, b)
+    if processes == 1 or len(m) <= shardsize:
+        return encrypt_padded(m, k)
 
-    ciphervals = []
-    for c in chunks:
-        ciphervals += encrypt(c, k)
-
-    return ciphervals
+    shards = chunk(m, shardsize)
+    with Pool(processes) as pool:
+        return b"".join( pool.imap(partial(encrypt_padded, k=k), shards) )
 
 def decrypt_2n(c, k):
     """
-    c is a list of ints, the ciphertext
+    c is a bytes object (or list of ints), the ciphertext
     k is a list of ints, the keybytes to use for decryption
 
+    returns the decrypted string (still padded)
     """
     b = len(k)  # get the block length
 
-    chunks = chunk(c, 2*b) #encryption doubles the block size
+    c = bytes(c)
+    assert len(c) % (2*b) == 0   #encryption doubles the block size
+    n = len(c) // 2
 
-    s = ""
-    for c in chunks:
-        s = s+decrypt(c,k)
+    ## split the r blocks from the c2 blocks
+    r = bytearray(n)
+    c2 = bytearray(n)
+    for i in range(b):
+        r[i::b] = c[i::2*b]
+        c2[i::b] = c[b+i::2*b]
 
-    return s
+    pvals = xor_vals(r, c2, bytes(k)*(n//b))
+
+    return pvals.decode('latin-1')
 
 
 def test2n(s, b):
@@ -165,4 +224,163 @@ def test2n(s, b):
 
     plaintext = decrypt_2n(ciphervals,k)
 
-    return plaintext
\ No newline at end of file
+    return plaintext
+
+## STREAMING
+## the functions below are generator stages that pass one block at a time 
+## along, so a message of any size is encrypted or decrypted in constant 
+## memory:
+##   read_blocks -> encrypt_blocks -> outstream
+##   read_cipher_blocks -> decrypt_blocks -> unpad_blocks -> outstream
+
+def encrypt_block(m, k):
+    """
+    m is a bytes object, one block of plaintext
+    k is a list of ints, equal in length to m, the keybytes
+    returns a bytes object, r followed by r XOR k XOR m (as encrypt gives)
+    """
+    assert len(k) == len(m)
+    r = random_bytes(len(m))
+    return r + xor_vals(r, k, m)
+
+def decrypt_block(c, k):
+    """
+    c is a bytes object, one block of ciphertext, twice as long as k
+    k is a list of ints, the keybytes
+    returns a bytes object, the plaintext block
+    """
+    n = len(k)
+    assert len(c) == 2*n
+    return xor_vals(c[:n], c[n:], k)
+
+def read_blocks(instream, b, chunksize=2**16):
+    """
+    instream is a readable text or binary stream
+    b is an int, the block length
+    chunksize is the number of characters to read at a time
+
+    yields b-length bytes objects. the final block is pkcs5 padded, 
+    as pkcs5_pad (a whole block of padding if the stream ends on a
+    block boundary)
+    """
+    chunksize -= chunksize % b   # whole blocks only, so nothing carries over
+    chunksize = max(chunksize, b)
+    buf = b""
+
+    while True:
+        chunk = instream.read(chunksize)
+        if isinstance(chunk, str):
+            chunk = chunk.encode('latin-1')
+        buf += chunk
+        if len(buf) < chunksize and chunk:
+            continue    # a short read, not the end of the stream
+        
+        end = len(buf) - len(buf)%b
+        for i in range(0, end, b):
+            yield buf[i:i+b]
+        buf = buf[end:]
+
+        if not chunk:
+            break
+
+    p = b - len(buf)
+    yield buf + bytes([p])*p
+
+def read_cipher_blocks(instream, b, chunksize=2**16):
+    """
+    instream is a readable binary stream of ciphertext
+    b is an int, the block length (the key length)
+    chunksize is the number of bytes to read at a time
+
+    yields 2b-length bytes objects, the ciphertext blocks
+    raises ValueError if the stream does not end on a block boundary
+    """
+    n = 2*b     #encryption doubles the block size
+    buf = b""
+
+    while True:
+        chunk = instream.read(chunksize)
+        if not chunk:
+            break
+        buf += chunk
+
+        end = len(buf) - len(buf)%n
+        for i in range(0, end, n):
+            yield buf[i:i+n]
+        buf = buf[end:]
+
+    if buf:
+        raise ValueError("ciphertext is not a whole number of blocks")
+
+def encrypt_blocks(blocks, k):
+    """
+    blocks is an iterable of plaintext blocks, eg from read_blocks
+    k is a list of ints, the keybytes
+    yields the ciphertext blocks
+    """
+    for m in blocks:
+        yield encrypt_block(m, k)
+
+def decrypt_blocks(blocks, k):
+    """
+    blocks is an iterable of ciphertext blocks, eg from read_cipher_blocks
+    k is a list of ints, the keybytes
+    yields the plaintext blocks
+    """
+    for c in blocks:
+        yield decrypt_block(c, k)
+
+def unpad_blocks(blocks):
+    """
+    blocks is an iterable of plaintext blocks, eg from decrypt_blocks
+    yields the blocks with the pkcs5 padding removed from the final one
+    raises ValueError if there are no blocks or the padding is invalid, 
+    eg the ciphertext was altered or the key is wrong
+    """
+    last = None
+    for block in blocks:
+        if last is not None:
+            yield last
+        last = block
+
+    if last is None:
+        raise ValueError("no blocks, the padding is missing")
+
+    p = last[-1]
+    if not 1 <= p <= len(last) or last[-p:] != bytes([p])*p:
+        raise ValueError("invalid padding")
+
+    yield last[:-p]
+
+def encrypt_stream(k, instream, outstream, chunksize=2**16):
+    """
+    k is a list of ints, the keybytes
+    instream is a readable text or binary stream, the message
+    outstream is a writable binary stream
+    chunksize is the number of characters to read at a time
+
+    returns the number of ciphertext bytes written
+    """
+    tot = 0
+    for c in encrypt_blocks(read_blocks(instream, len(k), chunksize), k):
+        outstream.write(c)
+        tot += len(c)
+    return tot
+
+def decrypt_stream(k, instream, outstream, chunksize=2**16):
+    """
+    k is a list of ints, the keybytes
+    instream is a readable binary stream, the ciphertext
+    outstream is a writable binary stream
+    chunksize is the number of bytes to read at a time
+
+    writes the unpadded plaintext and returns the number of bytes written
+    raises ValueError if the ciphertext is not whole blocks or
+    its padding is invalid
+    """
+    tot = 0
+    blocks = read_cipher_blocks(instream, len(k), chunksize)
+    for m in unpad_blocks(decrypt_blocks(blocks, k)):
+        outstream.write(m)
+        tot += len(m)
+    return tot
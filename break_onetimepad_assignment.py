@@ -13,48 +13,17 @@
 # 
 #  
 
+from collections import Counter
 from itertools import combinations
+from math import log
+
+from hex_codec import hexstring_to_vals, vals_to_hexstring
+from ngram_model import ENG_BIGRAM_FREQ, UNSORTED_ENG_FREQ, byte_log_probs, load_table
 
 
 ########################
 ###  helper functions ##
 ########################
-def hexstring_to_vals(hexstring):
-    """ 
-    hexstring is a string representation of hex bytes
-            eg "F96DE8C2" 
-    it must contain even number of valid chars (0->9 , A->F , a->f)
-    returns a list of ints, the values of the bytes
-    """
-    assert len(hexstring)%2 == 0
-
-    vals = []   #will contain int value of each hex byte
-    for i in range(0, len(hexstring)-1, 2):
-        pair = hexstring[i:i+2]  #this is a string like "E3"
-        val = int(pair, 16)      # throws value error if pair includes nonhex chars
-        vals.append(val)
-
-    ## nb with list comprehension:
-    ## vals = [int(hexstring[i:i+2], 16)] for i in range(0, len(hexstring)-1, 2)
-
-    return vals
-
-def vals_to_hexstring(vals):
-    """
-    vals is a list ints, corresponding to byte values, in range 0->255
-    returns a string, the hexadecimal representation of those bytes
-    """
-    s = ""
-    for val in vals:
-        assert val >=0 and val <=255   # must represent a byte
-        hexval = hex(val)[2:]  #strip out leading '0x'
-        if len(hexval)==1:
-            hexval = '0'+ hexval  #and add leading zero if needed
-        s = s + hexval
-
-    return s
-
-
 def string_to_vals(s):
     """
     s is a string of text
@@ -430,8 +399,368 @@ def xor_vals(vals1, vals2):
 
   
 
+########################
+###  many-time pad  ####
+########################
+
+## XOR_TABLES[k] is a bytes translation table that XORs every byte with k
+XOR_TABLES = [ bytes(val^k for val in range(256)) for k in range(256) ]
+
+## printable ascii values, 32 =< val < 127 (see are_printable_asciivals)
+PRINTABLE = bytes(range(32, 127))
+
+def column_keybytes(column):
+    """
+    column is a bytes object, the values at the same position of many 
+    ciphertexts that were all encrypted with the same key
+
+    does the same job as extract_keybyte, but without looking at any 
+    pairs: the values are counted once, and for each distinct value v
+    the number of column entries that make a letter-nonletter pair with 
+    it is the sum of the counts of v^x for the 64 values x in 0x40->0x7f
+    (see is_letter_and_nonletter). that makes the cost depend on the 
+    number of distinct values, not the number of ciphertexts
+
+    returns a list of candidate keybytes, most likely first, that decrypt 
+    the whole column to printable ascii
+    """
+    counts = Counter(column)
+    tot = len(column)
+
+    ## a value is presumed to be a nonletter if it pairs as a 
+    ## letter-nonletter with more than half of the other entries
+    nonletters = []
+    for v, n in counts.items():
+        votes = sum(counts.get(v^x, 0) for x in range(0x40, 0x80))
+        if votes > (tot - n)/2:
+            nonletters.append(v)
+    
+    nonletters.sort(key=lambda v:counts[v], reverse=True)
+
+    keybytes = []
+    for v in nonletters:
+        for c in [' ', '.', ',']:
+            keybyte = v ^ ord(c)
+            if keybyte in keybytes:
+                continue
+            ## deleting the printable values from the decrypted column 
+            ## leaves nothing if they were all printable
+            pvals = column.translate(XOR_TABLES[keybyte])
+            if not pvals.translate(None, PRINTABLE):
+                keybytes.append(keybyte)
+
+    return keybytes
+
+def recover_pad_key(ciphs):
+    """
+    ciphs is a list of equal-length ciphertexts (bytes, or lists of ints)
+    all encrypted with the same key
+
+    stacks the ciphertexts into a single matrix with one ciphertext per row,
+    so that every column (all the values encrypted with the same keybyte) 
+    is a strided slice of it, and runs column_keybytes on each column
+
+    returns the key as a list of ints, with 0 for any keybyte that 
+    could not be determined (as for KEY)
+    """
+    mlen = len(ciphs[0])
+    assert all(len(ciph) == mlen for ciph in ciphs)
+
+    matrix = b"".join( bytes(ciph) for ciph in ciphs )
+
+    key = [0]*mlen
+    for pos in range(mlen):
+        keybytes = column_keybytes( matrix[pos::mlen] )
+        if len(keybytes) > 0:
+            key[pos] = keybytes[0]  ## just take the first value
+
+    return key
+
+## translation table for showing plaintext values: printable ones are 
+## kept and anything else is shown as '?'
+DISPLAY = bytes( val if 32 <= val < 127 else ord('?') for val in range(256) )
+
+class PadRecoverySession(object):
+    def __init__(self, ciphstrings=hexciphs, key=None):
+        """
+        ciphstrings is a list of hex ciphertexts all encrypted with the same key
+        key is the list of keybytes found so far, 0 for unknown (as for KEY),
+        or None if nothing is known yet
+
+        the ciphertexts are decoded once into a matrix with one (zero padded)
+        ciphertext per row, so that the values encrypted with keybyte pos are 
+        the strided slice self.matrix[pos::self.mlen]. the plaintexts are kept
+        in a matrix of the same shape, with '*' for unknown keybytes, and 
+        setting a keybyte only redoes that one column of it
+        """
+        self.ciphs = [hexstring_to_vals(h) for h in ciphstrings]
+        self.lengths = [len(ciph) for ciph in self.ciphs]
+        self.mlen = max(self.lengths)
+
+        self.matrix = b"".join( ciph + bytes(self.mlen-len(ciph)) for ciph in self.ciphs )
+        self.plain = bytearray(b"*"*len(self.matrix))
+
+        self.key = [0]*self.mlen
+        self.candidate_cache = {}  # pos --> list of candidate keybytes
+        self.undo_stack = []       # (pos, old keybyte, new keybyte) edits
+        self.redo_stack = []
+
+        if key is not None:
+            for pos in range(self.mlen):
+                self.apply_keybyte(pos, key[pos])
+
+    def __str__(self):
+        return "\n".join(self.plaintexts())
+
+    def column(self, pos):
+        """
+        pos is an int, a position in the key
+        returns a bytes object, the ciphertext values encrypted with keybyte pos
+        (only from ciphertexts long enough to have a value there)
+        """
+        column = self.matrix[pos::self.mlen]
+        return bytes( column[i] for i in range(len(column)) if self.lengths[i] > pos )
+
+    def candidates(self, pos):
+        """
+        pos is an int, a position in the key
+        returns the list of candidate keybytes for pos from extract_keybyte,
+        which is only worked out the first time it is asked for
+        """
+        if pos not in self.candidate_cache:
+            self.candidate_cache[pos] = extract_keybyte( list(self.column(pos)) )
+        return self.candidate_cache[pos]
+
+    def apply_keybyte(self, pos, keybyte):
+        """
+        pos is an int, a position in the key
+        keybyte is an int in range 0->255, 0 for unknown
+        sets the keybyte and redoes that column of the plaintexts
+        """
+        self.key[pos] = keybyte
+        if keybyte == 0:
+            self.plain[pos::self.mlen] = b"*"*len(self.ciphs)
+        else:
+            column = self.matrix[pos::self.mlen]
+            self.plain[pos::self.mlen] = column.translate(XOR_TABLES[keybyte])
+
+    def set_keybyte(self, pos, keybyte):
+        """
+        pos is an int, a position in the key
+        keybyte is an int in range 0->255, 0 to mark it unknown again
+        sets the keybyte, as an edit that can be undone
+        """
+        assert keybyte >= 0 and keybyte <= 255
+        self.undo_stack.append( (pos, self.key[pos], keybyte) )
+        self.redo_stack = []
+        self.apply_keybyte(pos, keybyte)
+
+    def set_char(self, i, pos, c):
+        """
+        i is an int, the index of a ciphertext
+        pos is an int, a position in the key
+        c is a single character we believe plaintext i has at pos
+        sets the keybyte that makes it so (like the manual KEY[6] = 0x4f ^ ord('l'))
+        """
+        self.set_keybyte(pos, self.ciphs[i][pos] ^ ord(c))
+
+    def undo(self):
+        """
+        undoes the last edit
+        returns False if there was nothing to undo, True otherwise
+        """
+        if not self.undo_stack:
+            return False
+        pos, old, new = self.undo_stack.pop()
+        self.redo_stack.append( (pos, old, new) )
+        self.apply_keybyte(pos, old)
+        return True
+
+    def redo(self):
+        """
+        redoes the last undone edit
+        returns False if there was nothing to redo, True otherwise
+        """
+        if not self.redo_stack:
+            return False
+        pos, old, new = self.redo_stack.pop()
+        self.undo_stack.append( (pos, old, new) )
+        self.apply_keybyte(pos, new)
+        return True
+
+    def plaintexts(self):
+        """
+        returns a list of strings, the plaintexts as far as they are known,
+        with '*' for unknown keybytes and '?' for unprintable values
+        """
+        rows = []
+        for i in range(len(self.ciphs)):
+            row = self.plain[i*self.mlen : i*self.mlen + self.lengths[i]]
+            rows.append( row.translate(DISPLAY).decode('ascii') )
+        return rows
+
+    def export(self, path):
+        """
+        path is the name of the file to write to
+        writes the key as a hexstring (00 for unknown keybytes) on the 
+        first line, followed by the plaintexts one per line
+        """
+        with open(path, 'w') as f:
+            f.write(vals_to_hexstring(self.key) + "\n")
+            for row in self.plaintexts():
+                f.write(row + "\n")
+
+########################
+###  crib dragging  ####
+########################
+
+## words that are likely to appear in any english plaintext
+CRIBS = [" the ", " and ", " that ", " with ", " have ", " this ", " from ",
+         " they ", " will ", " what ", " when ", " there ", " their ", " which ",
+         " should ", " would ", " about ", " one ", " not ", " for ", " are ",
+         " was ", " you ", " his ", " her ", " him ", " our ", " all ", " but ",
+         " is ", " to ", " of ", " in ", " it ", " on ", " be ", " we ", " do ",
+         "The ", "This ", "When ", "What ", "There ", "They ", "We ", "He ", "She "]
+
+## log probability of each byte value in english plaintext
+UNIGRAM_SCORES = byte_log_probs()
+
+def gen_bigram_bonus():
+    """
+    returns a dictionary mapping a common pair of byte values (in either 
+    case) to how much more likely it is than its two letters apart, 
+    log( freq(pair) / (freq(first)*freq(second)) )
+
+    uses every printable pair from the printable model instead if one has 
+    been built (see ngram_model)
+    """
+    unigrams = load_table("printable", 1)
+    bigrams = load_table("printable", 2)
+    if unigrams is not None and bigrams is not None:
+        return { (a+32, b+32): bigrams[a*95+b] - unigrams[a] - unigrams[b]
+                 for a in range(95) for b in range(95) }
+
+    lett_freq = dict(UNSORTED_ENG_FREQ)
+    bonus = {}
+    for bigram, f in ENG_BIGRAM_FREQ:
+        b = log( (f/100) / (lett_freq[bigram[0]]/100 * lett_freq[bigram[1]]/100) )
+        for pair in [bigram, bigram.lower(), bigram[0] + bigram[1].lower()]:
+            bonus[ (ord(pair[0]), ord(pair[1])) ] = b
+    return bonus
+
+BIGRAM_BONUS = gen_bigram_bonus()
+
+def score_text(vals):
+    """
+    vals is a list of ints (or bytes), presumed plaintext values
+    returns a float, the average log probability per value under a 
+    letter model with a bonus for common bigrams (higher is more english)
+    """
+    if len(vals) == 0:
+        return 0.0
+    score = sum(UNIGRAM_SCORES[v] for v in vals)
+    score += sum(BIGRAM_BONUS.get(pair, 0) for pair in zip(vals, vals[1:]))
+    return score/len(vals)
+
+def xor_bytes(vals1, vals2):
+    """
+    vals1 and vals2 are bytes objects (or lists of ints)
+    returns a bytes object, the xor of vals1[i] and vals2[i]
+    for i up to the length of the shorter one
+    the values are XORed as two big ints rather than one pair at a time
+    """
+    n = min(len(vals1), len(vals2))
+    x = int.from_bytes(bytes(vals1[:n]), 'big') ^ int.from_bytes(bytes(vals2[:n]), 'big')
+    return x.to_bytes(n, 'big')
+
+def gen_xor_index(ciphs):
+    """
+    ciphs is a list of ciphertexts (bytes, or lists of ints) encrypted
+    with the same key
+
+    returns a dictionary mapping every ordered pair (i, j) of ciphertext 
+    indices, i != j, to ciphs[i] XOR ciphs[j], which is also the XOR of 
+    the two plaintexts (see is_letter_and_nonletter)
+    """
+    xor_index = {}
+    for i, j in combinations(range(len(ciphs)), 2):
+        xor_index[(i, j)] = xor_index[(j, i)] = xor_bytes(ciphs[i], ciphs[j])
+    return xor_index
+
+def drag_crib(crib, ciphs, xor_index, min_score=-4.0):
+    """
+    crib is a string, a word that may be in one of the plaintexts
+    ciphs is a list of ciphertexts encrypted with the same key
+    xor_index is the result of gen_xor_index(ciphs)
+    min_score is the lowest score_text that counts as english
+
+    slides crib along every ciphertext i. if plaintext i has crib at pos,
+    every other plaintext j has  crib XOR (ciphs[i] XOR ciphs[j])  there,
+    read straight from the xor index. a placement is a hit if all of those 
+    are printable and score as english on average
+
+    returns a list of hits (score, i, pos, keyvals), where keyvals are the 
+    keybytes from pos onwards implied by the hit
+    """
+    cvals = crib.encode('ascii')
+    m = len(cvals)
+    crib_score = score_text(cvals)
+    hits = []
+
+    for i in range(len(ciphs)):
+        others = [j for j in range(len(ciphs)) if j != i]
+        for pos in range(len(ciphs[i]) - m + 1):
+            plaintexts = []
+            for j in others:
+                pvals = xor_bytes(xor_index[(i, j)][pos:pos+m], cvals)
+                if len(pvals) < m or pvals.translate(None, PRINTABLE):
+                    break   # plaintext j is too short or not printable here
+                plaintexts.append(pvals)
+            else:
+                score = (crib_score + sum(map(score_text, plaintexts)))/len(ciphs)
+                if score >= min_score:
+                    keyvals = xor_bytes(ciphs[i][pos:pos+m], cvals)
+                    hits.append( (score, i, pos, keyvals) )
+
+    return hits
+
+def crib_drag(ciphs, key=None, cribs=CRIBS, min_score=-4.0):
+    """
+    ciphs is a list of ciphertexts (bytes, or lists of ints) encrypted 
+    with the same key
+    key is a list of ints, the key found so far, with 0 for unknown 
+    keybytes (as for KEY and recover_pad_key), or None if nothing is known
+    cribs is a list of words to drag
+    min_score is the lowest score_text that counts as english
+
+    drags every crib and then extends the key greedily: hits are taken 
+    best score first, and a hit is applied if it agrees with every known
+    keybyte and sets at least one unknown one. known keybytes are never
+    changed, so a hit turned down once would be turned down again, and 
+    one pass over the hits is enough
+
+    returns the extended key as a new list of ints
+    """
+    mlen = max(len(ciph) for ciph in ciphs)
+    key = [0]*mlen if key is None else list(key)
+    xor_index = gen_xor_index(ciphs)
+
+    hits = []
+    for crib in cribs:
+        hits += drag_crib(crib, ciphs, xor_index, min_score)
+    hits.sort(key=lambda hit:hit[0], reverse=True)
+
+    for score, i, pos, keyvals in hits:
+        span = range(pos, pos+len(keyvals))
+        known = [key[p] == k for p, k in zip(span, keyvals) if key[p] != 0]
+        if all(known) and len(known) < len(keyvals):
+            for p, k in zip(span, keyvals):
+                key[p] = k
+
+    return key
+
 ### old
-from random import randint
+from key_material import random_bytes
 
 
 
@@ -442,7 +771,7 @@ def genkey(n):
     returns the key as a list of ints, where each int is in the range 0-->255
 
     """
-    key = [randint(0, 255) for i in range(n)]
+    key = list( random_bytes(n) )  # from the OS secure generator, not randint
     return key
 
 def encrypt(plaintext):
@@ -12,6 +12,10 @@
 ## also int("0xff", 16) = 255
 
 #from enum import unique
+from collections import Counter
+
+from coincidence import best_period, match_rates
+from hex_codec import hexstring_to_vals, vals_to_hexstring
 
 
 
@@ -35,6 +39,17 @@ def xor_char(c, byte):
     # print("result is", hex(result))
     return hex(result)[2:]
 
+def xor_with_keys(vals, keys):
+    """
+    vals is a bytes object
+    keys is a list of ints between 0 and 255, used over and over
+    returns a bytes object, each of vals XORed with its key, done as one
+    XOR of two big ints
+    """
+    n = len(vals)
+    keystream = (bytes(keys) * (n//len(keys) + 1))[:n]
+    return (int.from_bytes(vals, 'big') ^ int.from_bytes(keystream, 'big')).to_bytes(n, 'big')
+
 def encrypt(keys, plaintext):
     """
     plaintext is a string, the message to encrypt
@@ -46,33 +61,16 @@ def encrypt(keys, plaintext):
 
     print("keys:", keys)
 
-    ciphertext = ""
-
-    ikey = 0  # index of next key to use
-    for c in plaintext:
-
-        ciphertext = ciphertext + xor_char(c, keys[ikey])
-        ikey = (ikey+1)%(len(keys))  #increment key index
-
-    return ciphertext
+    return vals_to_hexstring( xor_with_keys(plaintext.encode('latin-1'), keys) )
 
 def decrypt(keys, ciphertext):
     """
     ciphertext is a string representation of hex characters to decrypt
     key is a list of ints between 0 and 255 (ie between 0x00 and 0xFF)
     returns the plaintext obtained by decrypting ciphertext using keys
+    raises ValueError if ciphertext is not valid hex
     """
-    plaintext = ""
-    ikey = 0
-
-    for i in range(0, len(ciphertext)-1, 2):
-        hexstring = ciphertext[i:i+2]
-        c = chr( int(hexstring,16) ^ keys[ikey] )
-        plaintext = plaintext + c
-
-        ikey = (ikey+1)%(len(keys))  #increment key index
-
-    return plaintext
+    return xor_with_keys(hexstring_to_vals(ciphertext), keys).decode('latin-1')
 
 
 def test():
@@ -113,7 +111,7 @@ class DataStats(object):
 
     def __str__(self):
         s = "datastats\n"
-        s = s +"items=\n"+str(self.items)+"\n"
+        s = s +"items=\n"+str(list(self.items))+"\n"
         s = s + "numitems: "+ str(self.numitems) + "\n"
         s = s + "distribution:\n"+ str(self.distribution) + "\n"
         s = s + "variance: " + str(self.variance)+"\n"
@@ -139,11 +137,11 @@ class DataStats(object):
         tot = len(lst)
         assert tot>0
 
-        unique_items = list(set(lst)) #set removes duplicates
+        counts = Counter(lst)  #count of every unique item, in one pass over lst
         # print("total of", tot, "items")
-        # print("of which", len(unique_items), "unique items:\n", unique_items)
-        for item in unique_items:
-            f = round( ( 100*lst.count(item) )/tot, 3) # X100 FOR PERCENT
+        # print("of which", len(counts), "unique items:\n", list(counts))
+        for item, n in counts.items():
+            f = round( ( 100*n )/tot, 3) # X100 FOR PERCENT
             freqs.append( (item, f) ) #append tuple to list
         ret = sorted(freqs,  key=lambda item:item[1], reverse=True)   
         # print("frequencies are", ret)
@@ -151,7 +149,8 @@ class DataStats(object):
 
     def every_nth_item(self, start=0, n=1):
         """ n is an integer 
-            returns a list of every nth item in self.items
+            returns a list (or view, if self.items is a memoryview) 
+            of every nth item in self.items
             from specified start index of list
             (eg start=0, n=2 will return elemenst at pos 0, pos2, pos 4..)
                 start=3, n=2 will return elements at pos 3, 5, 7, 9...)
@@ -162,7 +161,7 @@ class DataStats(object):
                                             ## retrieve every 10th character
             return []
         else:
-            return [self.items[i] for i in range(start, numitems, n )]
+            return self.items[start::n]
             ## eg with start=0 and n=2 the first item is at index 0 and the 
             ##     next item at index 2...
             ##   with start = 2 and n=2 the first item is at index 2 and the next at
@@ -189,18 +188,14 @@ class HexDataSet(DataStats):
         return s
 
     def prep_ciphertext(self, ciphertext):
-        """ciphertext is a string representation of hex-encrypted characters'
+        """ciphertext is a string representation of hex-encrypted characters
         eg "F96DE8C2"
-        returns a list of pairs of characters, so that each item is the 
-        string representation of a hex byte
-        eg ["F9", "6D", "E8", "C2"]
+        returns a memoryview over the decoded bytes, so that each item is 
+        the int value of a hex byte
+        eg [0xF9, 0x6D, 0xE8, 0xC2]
+        slicing it (eg to take every nth item) gives views, not copies
         """
-        bytes = []   #will contain string representations of each hex byte
-        for i in range(0, len(ciphertext)-1, 2):
-            hexstring = ciphertext[i:i+2]
-            bytes.append(hexstring)
-
-        return bytes
+        return memoryview( hexstring_to_vals(ciphertext) )
 
 
 
@@ -230,26 +225,26 @@ def find_key_length(ciphertext=CIPH, max_key_len=13):
         max_key_len is an int, the largest possible length of the key
         we assume the minimum key length is 1
 
-        For n = 1 to max_key_len, we compile a list of every nth character. If n is the key length, these characters will 
-        all have been encrypted with the same key.
+        For n = 1 to max_key_len, the characters n apart (every nth character) 
+        are compared. If n is the key length, they will all have been 
+        encrypted with the same key byte, so they are equal about as often as 
+        in english (much more often than 1/256 = .0039, the uniform 
+        distribution case). 
+        All the key lengths are scanned together, see coincidence.py
+        returns the list of qstats, where the qstat for n is at index n-1
     """
     hx = HexDataSet(ciphertext)  #hex data set of entire ciphertext
 
-    ## for each possible key length n, create sublist of every nth character
-    ## and compute stats for the sublist
-    stats = []
-    for n in range(1, max_key_len+1):
-        nth_hx = hx.every_nth_item(0,n) #list of every nth item
-
-        nth_stats = DataStats(nth_hx)
-        stats.append(nth_stats.variance)
+    ## chance that two of every nth item are equal, for each possible n
+    qstats = match_rates(hx.items, max_key_len)
+    print(qstats)
 
-    ## the key length will correspond to the highest variance
-    maxvar = max(stats)
-    keylen = stats.index(maxvar)+1  #variance for keylen1 is 0th element in list, etc.
+    ## the key length will correspond to the highest qstat
+    ## (or the smallest of its multiples that score as high)
+    keylen = best_period(qstats, 1/256)
     print("the keylength is", keylen)  #key length = 7 for CIPH
 
-    return stats
+    return qstats
 
 def find_key(ciphertext=CIPH, keylen=7):
     """
@@ -274,10 +269,8 @@ def find_key(ciphertext=CIPH, keylen=7):
         # which has integer value 32
         topitem = nth_stats.get_top_item()
 
-        # topitem is returned as a string representation of a hex byte
-        # eg "3F" , but we now change it into an actual int value
-        # of an encrypted character
-        cipherval = int(topitem, 16)
+        # topitem is the int value of an encrypted character
+        cipherval = topitem
 
         # encryptedtext XOR plaintext = key
 
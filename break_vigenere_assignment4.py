@@ -11,6 +11,19 @@
 ## eg int("FF", 16) = 255 
 ## also int("0xff", 16) = 255
 
+import json
+import os
+from collections import Counter
+from functools import partial
+from itertools import islice, repeat
+from math import exp
+from multiprocessing import Pool
+from operator import add, mul
+
+from coincidence import best_period, match_rates
+from hex_codec import hexstring_to_vals
+from ngram_model import byte_log_probs
+
 ## HELPER FUNCTIONS
 
 def string_to_vals(s):
@@ -33,26 +46,6 @@ def vals_to_string(pvals):
         s = s+chr(v)
     return s
 
-def hexstring_to_vals(hexstring):
-    """ 
-    hexstring is a string representation of hex bytes
-            eg "F96DE8C2" 
-    it must contain even number of valid chars (0->9 , A->F , a->f)
-    returns a list of ints, the values of the bytes
-    """
-    assert len(hexstring)%2 == 0
-
-    vals = []   #will contain int value of each hex byte
-    for i in range(0, len(hexstring)-1, 2):
-        pair = hexstring[i:i+2]  #this is a string like "E3"
-        val = int(pair, 16)      # throws value error if pair includes nonhex chars
-        vals.append(val)
-
-    ## nb with list comprehension:
-    ## vals = [int(hexstring[i:i+2], 16)] for i in range(0, len(hexstring)-1, 2)
-
-    return vals
-
 def are_asciivals(vals):
     """
     vals is a list of ints
@@ -103,8 +96,9 @@ def sum_q_squared(bytevals):
     """
     sum=0
     tot = len(bytevals)
-    for i in range(256):
-        sum+= (bytevals.count(i)/tot)**2
+    counts = Counter(bytevals)   #count of every byte value, in one pass
+    for n in counts.values():
+        sum+= (n/tot)**2
 
     return sum
 
@@ -148,6 +142,13 @@ def find_key_val(ciphvals):
             validkeys[keyval] = vals_to_string(plainvals)
     print(validkeys)
 
+## the qstat of every key length n from 1 to max_key_len, in one scan
+## (see coincidence.py). the qstat for n is the chance that two bytes in the
+## same every-nth subsequence are equal, ie the average sum_q_squared of 
+## try_key_len, and the key length is the smallest n whose qstat is near 
+## the top
+UNIFORM_QSTAT = 1/256
+
 ## CIPH is the ciphertext provided for the assignment 
 CIPH = "F96DE8C227A259C87EE1DA2AED57C93FE5DA36ED4EC87EF2C63AAE5B9A7EFFD673BE4ACF7BE8923CAB1ECE7AF2DA3DA44FCF7AE29235A24C963FF0DF3CA3599A70E5DA36BF1ECE77F8DC34BE129A6CF4D126BF5B9A7CFEDF3EB850D37CF0C63AA2509A76FF9227A55B9A6FE3D720A850D97AB1DD35ED5FCE6BF0D138A84CC931B1F121B44ECE70F6C032BD56C33FF9D320ED5CDF7AFF9226BE5BDE3FF7DD21ED56CF71F5C036A94D963FF8D473A351CE3FE5DA3CB84DDB71F5C17FED51DC3FE8D732BF4D963FF3C727ED4AC87EF5DB27A451D47EFD9230BF47CA6BFEC12ABE4ADF72E29224A84CDF3FF5D720A459D47AF59232A35A9A7AE7D33FB85FCE7AF5923AA31EDB3FF7D33ABF52C33FF0D673A551D93FFCD33DA35BC831B1F43CBF1EDF67F0DF23A15B963FE5DA36ED68D378F4DC36BF5B9A7AFFD121B44ECE76FEDC73BE5DD27AFCD773BA5FC93FE5DA3CB859D26BB1C63CED5CDF3FE2D730B84CDF3FF7DD21ED5ADF7CF0D636BE1EDB79E5D721ED57CE3FE6D320ED57D469F4DC27A85A963FF3C727ED49DF3FFFDD24ED55D470E69E73AC50DE3FE5DA3ABE1EDF67F4C030A44DDF3FF5D73EA250C96BE3D327A84D963FE5DA32B91ED36BB1D132A31ED87AB1D021A255DF71B1C436BF479A7AF0C13AA14794"
 
@@ -164,17 +165,14 @@ def find_key_len(ciphertext=CIPH, max_key_len=13):
     ## convert ciphertext hexstring to a list of integer values
     ciphvals = hexstring_to_vals(ciphertext)
 
-    ## for each possible key length n, create sublist of every nth character
-    ## and compute stats for the sublist
-    qstats = []
-    for n in range(1, max_key_len+1):
-       qstats.append(try_key_len(ciphvals,n)) #list of every nth item
+    ## get the qstat for every possible key length n in one scan
+    qstats = match_rates(ciphvals, max_key_len)
 
     print(qstats)
 
     ## the key length will correspond to the highest qstat
-    maxq = max(qstats)
-    keylen = qstats.index(maxq)+1  #variance for keylen1 is 0th element in list, etc.
+    ## (or the smallest of its multiples that score as high)
+    keylen = best_period(qstats, UNIFORM_QSTAT)
     print("the keylength is", keylen)  #key length = 7 for CIPH
 
 
@@ -195,4 +193,157 @@ def decrypt(ciphvals, keyvals):
     
     return vals_to_string(plainvals)
 
-        
+
+
+## BYTE WEIGHTS
+## log probability of each byte value appearing in english plaintext. 
+## values that are not printable ascii get a tiny one, so a key that yields 
+## them is all but ruled out, as with are_asciivals
+BYTE_WEIGHTS = byte_log_probs()
+
+## XOR_SCORES[c][k] is the weight of the plaintext byte c^k, ie the score of 
+## keyval k for a single ciphertext byte c
+XOR_SCORES = [tuple(BYTE_WEIGHTS[c^k] for k in range(256)) for c in range(256)]
+
+def score_column(ciphvals):
+    """
+    ciphvals is a list of ints (or bytes), corresponding to ciphertext 
+    characters known to be encrypted with the same key
+
+    scores all 256 keyvals at once: the ciphertext values are counted once, 
+    and the count of each value c times its row XOR_SCORES[c] is added 
+    into the running total for every keyval
+
+    returns a tuple (keyval, confidence) for the best scoring keyval,
+    where confidence is its probability compared with all other keyvals
+    """
+    scores = [0.0]*256
+    for c, n in Counter(ciphvals).items():
+        scores = list( map(add, scores, map(mul, XOR_SCORES[c], repeat(n))) )
+
+    best = max(scores)
+    keyval = scores.index(best)
+    confidence = 1/sum(exp(s - best) for s in scores)
+
+    return (keyval, confidence)
+
+def recover_key(ciphvals, keylen, processes=None):
+    """
+    ciphvals is a list of ints (or bytes), corresponding to the ciphertext
+    keylen is an int, the length of the key
+    processes is the number of worker processes to score the columns on
+    (default: one per cpu, 1 scores them in this process)
+
+    every keylen-th value starting from pos was encrypted with key byte pos,
+    so each of those columns is scored independently with score_column
+
+    returns a tuple (keyvals, confidences), both lists of keylen values
+    """
+    view = memoryview( bytes(ciphvals) )
+    columns = [ bytes(view[pos::keylen]) for pos in range(keylen) ]
+
+    if processes == 1:
+        results = [score_column(column) for column in columns]
+    else:
+        with Pool(processes) as pool:
+            results = pool.map(score_column, columns)
+
+    keyvals = [keyval for keyval, confidence in results]
+    confidences = [confidence for keyval, confidence in results]
+    return (keyvals, confidences)
+
+## BATCH CRACKING
+
+def crack_one(item, max_key_len=13):
+    """
+    item is a tuple (id, ciphertext), where ciphertext is a string 
+    representation of hex-encrypted characters, like CIPH
+    max_key_len is an int, the largest possible length of the key
+
+    finds the key length and then the key, and returns a dictionary 
+    with the id, keylen, key (as a hexstring), the lowest per-byte 
+    confidence and the plaintext.
+    if the ciphertext is not valid hex, returns the id and an error instead
+    """
+    msgid, ciphertext = item
+    try:
+        ciphvals = hexstring_to_vals(ciphertext)
+    except ValueError:
+        return {"id": msgid, "error": "invalid hex ciphertext"}
+    if len(ciphvals) == 0:
+        return {"id": msgid, "error": "empty ciphertext"}
+
+    keylen = best_period( match_rates(ciphvals, max_key_len), UNIFORM_QSTAT )
+    keyvals, confidences = recover_key(ciphvals, keylen, processes=1)
+
+    return {"id": msgid, 
+            "keylen": keylen, 
+            "key": bytes(keyvals).hex(),
+            "confidence": min(confidences),
+            "plaintext": decrypt(ciphvals, keyvals)}
+
+def read_done_ids(outpath, blocksize=2**16):
+    """
+    outpath is the path of a JSONL results file written by crack_file
+    blocksize is the number of bytes read at a time looking for the last line
+    returns the set of ids already in the file (empty if there is no file)
+
+    a crash can leave a partly written last line, which is cut off here 
+    so new results can be appended after it. the last newline is found by 
+    reading back from the end of the file a block at a time, and the ids 
+    are then read a line at a time, so the file is never held in memory
+    """
+    if not os.path.exists(outpath):
+        return set()
+
+    with open(outpath, 'rb+') as f:
+        size = f.seek(0, os.SEEK_END)
+        end = size
+        while end > 0:
+            start = max(0, end - blocksize)
+            f.seek(start)
+            i = f.read(end - start).rfind(b"\n")
+            if i >= 0:
+                end = start + i + 1   # keep everything up to the last newline
+                break
+            end = start
+        if end < size:
+            f.truncate(end)
+
+        f.seek(0)
+        return {json.loads(line)["id"] for line in f if line.strip()}
+
+def crack_file(inpath, outpath, max_key_len=13, processes=None, batch_size=1000):
+    """
+    inpath is the path of a file of hex ciphertexts like CIPH, one per line
+    outpath is the path of the JSONL file to write one result per line to
+    max_key_len is an int, the largest possible length of the key
+    processes is the number of worker processes (default: one per cpu)
+    batch_size is the number of ciphertexts handed to the pool at a time
+
+    cracks every ciphertext with crack_one across a process pool. the id of 
+    a ciphertext is its line number in inpath. results are appended and 
+    flushed as they come in, and any ids already in outpath are skipped, 
+    so after a crash the same call picks up where it left off
+
+    returns the number of ciphertexts cracked by this call
+    """
+    done = read_done_ids(outpath)
+    tot = 0
+
+    with open(inpath) as f, open(outpath, 'a') as out, Pool(processes) as pool:
+        todo = ( (lineno, line.strip()) for lineno, line in enumerate(f, 1) 
+                 if line.strip() and lineno not in done )
+        crack = partial(crack_one, max_key_len=max_key_len)
+
+        while True:
+            batch = list(islice(todo, batch_size))
+            if not batch:
+                break
+
+            for result in pool.imap(crack, batch):
+                out.write(json.dumps(result) + "\n")
+                out.flush()
+            tot += len(batch)
+
+    return tot
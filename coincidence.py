@@ -0,0 +1,142 @@
+## coincidence counts, for finding the length of a repeating key
+##
+## if a text is encrypted with a key of length k used over and over, the
+## symbols a multiple of k apart were encrypted with the same key symbol,
+## so they are equal about as often as in the plaintext, while symbols
+## any other distance apart are equal about as often as random ones.
+## both the vigenere (letters) and the hex XOR (bytes) breakers scan every
+## candidate period with match_rates
+##
+## the matches for a period p are counted in one of two ways:
+##     columns   pairs of symbols in the same column data[r::p], from one
+##               pass of per-residue histograms over data
+##     lag       pairs of symbols exactly p apart. the whole text is held
+##               as one big int, so comparing every symbol with the one p
+##               places later is a single shift, XOR and count of zero
+##               bytes, with no python loop over the text
+## both have the same expected rate, but the lag costs the same for any p
+## and needs no histograms, so it is used for every period from MIN_LAG up
+
+from collections import Counter
+from itertools import cycle
+from math import gcd
+
+## symbols that are close together in english text are not independent
+## (eg double letters are rare), so the rate at lags shorter than this is
+## well below the rate for the same column even in plaintext
+MIN_LAG = 4
+
+def residue_counts(data, period):
+    """
+    data is a bytes object (or anything else that gives ints when iterated)
+    period is an int
+
+    returns a Counter of (residue, value) --> count, the histograms of
+    all the columns data[r::period] together, counted in one pass over data
+    """
+    return Counter(zip(cycle(range(period)), data))
+
+def column_matches(data, periods):
+    """
+    data is a bytes object
+    periods is a list of small ints
+
+    returns a list with a tuple (matches, pairs) for each period p, where
+    pairs is the number of ordered pairs of positions in the same column
+    data[r::p] and matches is the number of those that hold equal values
+
+    the histograms are counted once, for the least common multiple of the
+    periods, and the columns of each p are made by adding up the columns
+    of that which are the same mod p
+    """
+    common = 1
+    for p in periods:
+        common = common*p // gcd(common, p)
+    counts = residue_counts(data, common)
+    n = len(data)
+
+    results = []
+    for p in periods:
+        hist = Counter()
+        for (r, val), c in counts.items():
+            hist[r % p, val] += c
+        matches = sum(c*(c-1) for c in hist.values())
+        sizes = [len(range(r, n, p)) for r in range(p)]
+        pairs = sum(size*(size-1) for size in sizes)
+        results.append( (matches, pairs) )
+
+    return results
+
+def lag_matches(data, lags):
+    """
+    data is a bytes object
+    lags is a list of ints
+
+    returns a list with a tuple (matches, pairs) for each lag p, where pairs
+    is the number of positions i that have an i+p in data and matches is
+    the number of those where data[i] == data[i+p]
+    """
+    n = len(data)
+    big = int.from_bytes(data, 'big')
+
+    results = []
+    for p in lags:
+        if p >= n:
+            results.append( (0, 0) )
+            continue
+        head = big >> (8*p)                     # data[:n-p]
+        tail = big & ((1 << 8*(n-p)) - 1)       # data[p:]
+        matches = (head ^ tail).to_bytes(n-p, 'big').count(0)
+        results.append( (matches, n-p) )
+
+    return results
+
+def match_rates(data, max_period):
+    """
+    data is a bytes object, eg a ciphertext
+    max_period is an int, the largest candidate key length
+
+    returns a list of the chance that two values in the same column
+    data[r::p] are equal, for every p from 1 to max_period, where the rate
+    for p is at index p-1 (0.0 if no two values are p apart). periods below
+    MIN_LAG are counted by columns and the rest by lag
+    """
+    short = list(range(1, min(MIN_LAG, max_period+1)))
+    counts = column_matches(data, short) + lag_matches(data, range(len(short)+1, max_period+1))
+
+    return [matches/pairs if pairs else 0.0 for matches, pairs in counts]
+
+def period_threshold(rates, uniform):
+    """
+    rates is a list of rates as returned by match_rates
+    uniform is the rate expected of random values, eg 1/256 for bytes
+
+    every multiple of the real key length has a rate about as high as the
+    key length itself, while for a divisor below MIN_LAG the columns mix
+    values encrypted with different key symbols and score about half as
+    high. so the typical high rate is taken as the average of those closer
+    to the top than to uniform (which evens out the noise of any single
+    one), and returns the rate three quarters of the way from uniform up 
+    to that, which the key length and its multiples reach but divisors 
+    do not
+    """
+    top = max(rates)
+    high = [r for r in rates if r >= min(top, (top + uniform)/2)]
+    typical = sum(high)/len(high)
+
+    return uniform + 0.75*(typical - uniform)
+
+def best_period(rates, uniform):
+    """
+    rates is a list of rates as returned by match_rates
+    uniform is the rate expected of random values, eg 1/256 for bytes
+
+    returns the smallest period whose rate reaches period_threshold
+    """
+    threshold = period_threshold(rates, uniform)
+    for i in range(len(rates)):
+        if rates[i] >= threshold:
+            return i+1
+
+    ## nothing is above uniform (eg random values), just take the highest
+    return rates.index(max(rates))+1
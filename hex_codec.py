@@ -0,0 +1,142 @@
+## hex codec shared by the cipher and attack modules
+##
+## converts between hexstrings like "F96DE8C2" and byte values.
+## everything is done by binascii and bytes.hex, which run
+## in C, rather than a pair of characters at a time with int(pair, 16)
+## and hex(val)
+##
+## a bytes object is a sequence of ints in range 0->255, so the values
+## returned here can be indexed, iterated over and XORed like a list of ints
+
+import binascii
+import time
+from os import urandom
+
+
+def hexstring_to_vals(hexstring):
+    """
+    hexstring is a string representation of hex bytes
+            eg "F96DE8C2"
+    (or a bytes, bytearray or memoryview of those characters)
+    it must contain even number of valid chars (0->9 , A->F , a->f)
+    returns a bytes object, the values of the bytes
+    raises ValueError if hexstring is not valid hex
+    """
+    return binascii.unhexlify(hexstring)
+
+def vals_to_hexstring(vals):
+    """
+    vals is a list of ints, corresponding to byte values, in range 0->255
+    (or a bytes, bytearray or memoryview)
+    returns a string, the (lower case) hexadecimal representation of those bytes
+    raises ValueError if a value is not in range 0->255
+    """
+    if not isinstance(vals, (bytes, bytearray, memoryview)):
+        vals = bytes(vals)
+
+    return vals.hex()
+
+def hex_decode_stream(instream, outstream, chunksize=2**20):
+    """
+    instream is a readable text stream of hex characters,
+    which may be split across lines
+    outstream is a writable binary stream
+    chunksize is the number of characters to read at a time
+
+    writes the decoded bytes to outstream one chunk at a time and
+    returns the number of bytes written
+    raises ValueError if instream is not valid hex
+    """
+    tot = 0
+    carry = ""   # odd hex character left over from the previous chunk
+
+    while True:
+        chunk = instream.read(chunksize)
+        if not chunk:
+            break
+
+        chunk = carry + "".join(chunk.split())   # drop newlines and spaces
+        end = len(chunk) - len(chunk)%2
+        carry = chunk[end:]
+
+        vals = binascii.unhexlify(chunk[:end])
+        outstream.write(vals)
+        tot += len(vals)
+
+    if carry:
+        raise ValueError("odd number of hex characters")
+
+    return tot
+
+def hex_encode_stream(instream, outstream, chunksize=2**20):
+    """
+    instream is a readable binary stream
+    outstream is a writable text stream
+    chunksize is the number of bytes to read at a time
+
+    writes the hexstring of instream to outstream one chunk at a time
+    and returns the number of bytes encoded
+    """
+    tot = 0
+
+    while True:
+        chunk = instream.read(chunksize)
+        if not chunk:
+            break
+
+        outstream.write( binascii.hexlify(chunk).decode('ascii') )
+        tot += len(chunk)
+
+    return tot
+
+
+## the byte at a time versions this module replaces, kept for bench()
+def slow_hexstring_to_vals(hexstring):
+    vals = []
+    for i in range(0, len(hexstring)-1, 2):
+        pair = hexstring[i:i+2]
+        vals.append(int(pair, 16))
+    return vals
+
+def slow_vals_to_hexstring(vals):
+    s = ""
+    for val in vals:
+        hexval = hex(val)[2:]
+        if len(hexval)==1:
+            hexval = '0'+ hexval
+        s = s + hexval
+    return s
+
+def bench(size=100*2**20, sample=2**20):
+    """
+    size is an int, the number of bytes to encode and decode
+    sample is an int, the number of bytes to time the slow versions on
+
+    the slow versions take minutes on large inputs, so they are timed on
+    sample bytes and their time is scaled up to size bytes
+    """
+    vals = urandom(size)
+
+    t = time.perf_counter()
+    hexstring = vals_to_hexstring(vals)
+    t_encode = time.perf_counter() - t
+
+    t = time.perf_counter()
+    assert hexstring_to_vals(hexstring) == vals
+    t_decode = time.perf_counter() - t
+
+    scale = size/sample
+
+    t = time.perf_counter()
+    assert slow_vals_to_hexstring(vals[:sample]) == hexstring[:2*sample]
+    t_slow_encode = (time.perf_counter() - t)*scale
+
+    t = time.perf_counter()
+    slow_hexstring_to_vals(hexstring[:2*sample])
+    t_slow_decode = (time.perf_counter() - t)*scale
+
+    print("for", size, "bytes (slow versions scaled up from", sample, "bytes)")
+    print("encode: ", round(t_encode, 3), "s vs", round(t_slow_encode, 3),
+          "s, speedup", round(t_slow_encode/t_encode, 1), "x")
+    print("decode: ", round(t_decode, 3), "s vs", round(t_slow_decode, 3),
+          "s, speedup", round(t_slow_decode/t_decode, 1), "x")
@@ -0,0 +1,87 @@
+## key material for the one time pad and block cipher
+##
+## random.randint uses the Mersenne Twister, which is fast to predict once
+## you have seen some of its output, so it must never be used for keys.
+## os.urandom reads the operating system's cryptographically secure
+## generator, and asking it for bytes in large blocks (rather than one
+## call per byte) keeps it from being the slow part of making a pad
+
+import mmap
+import os
+import threading
+
+
+class KeyPool(object):
+    def __init__(self, bufsize=2**16):
+        """
+        bufsize is an int, the number of random bytes fetched from
+        os.urandom at a time
+        """
+        self.bufsize = bufsize
+        self.buf = b""
+        self.pos = 0      # index of the next unused byte in buf
+        self.lock = threading.Lock()
+
+    def get(self, n):
+        """
+        n is an int, the number of random bytes wanted
+        returns a bytes object of n random bytes, each handed out only once
+        """
+        if n >= self.bufsize:   # big requests skip the buffer
+            return os.urandom(n)
+
+        with self.lock:
+            if self.pos + n > len(self.buf):
+                self.buf = self.buf[self.pos:] + os.urandom(self.bufsize)
+                self.pos = 0
+
+            vals = self.buf[self.pos:self.pos+n]
+            self.pos += n
+
+        return vals
+
+    def clear(self):
+        """
+        drops any buffered bytes and starts a new lock
+
+        this is run in the child after a fork (see below). if another 
+        thread of the parent held the lock at the time of the fork, the 
+        child's copy stays locked forever, as that thread does not exist 
+        in the child, so the copy is replaced rather than reused
+        """
+        self.buf = b""
+        self.pos = 0
+        self.lock = threading.Lock()
+
+POOL = KeyPool()
+
+## a forked process starts with a copy of the buffer, and must not hand out
+## the same bytes as its parent
+os.register_at_fork(after_in_child=POOL.clear)
+
+
+def random_bytes(n):
+    """
+    n is an int, the number of random bytes wanted
+    returns a bytes object of n cryptographically secure random bytes
+    """
+    return POOL.get(n)
+
+def gen_pad_file(path, nbytes, chunksize=2**24):
+    """
+    path is the name of the pad file to create (it is overwritten if it exists)
+    nbytes is an int, the size of the pad in bytes
+    chunksize is the number of bytes generated at a time
+
+    fills the file with random bytes through a memory map, chunksize bytes
+    at a time, so pads of many GB never have to fit in memory
+    """
+    with open(path, 'wb+') as f:
+        f.truncate(nbytes)
+        if nbytes == 0:
+            return
+
+        with mmap.mmap(f.fileno(), nbytes) as mm:
+            for start in range(0, nbytes, chunksize):
+                end = min(start+chunksize, nbytes)
+                mm[start:end] = os.urandom(end-start)
@@ -0,0 +1,319 @@
+## n-gram models of english, built from a local plaintext corpus
+##
+## the hand copied statistics (UNSORTED_ENG_FREQ, ENG_BIGRAM_FREQ, ...) are
+## kept here for every scorer to fall back on, along with the letter encoder
+## and n-gram counter they all share. build_models counts 1- to 4-grams in any
+## amount of plaintext and writes each order out as a flat table of float32
+## natural log probabilities, where the n-gram with codes c1 c2 ... cn is
+## at index ((c1*size + c2)*size + ...)*size + cn
+##
+## there are two alphabets:
+##     letters    A->Z (either case) as 0->25, everything else dropped
+##     printable  ascii 32->126 as 0->94, whitespace as a space (0),
+##                everything else dropped
+##
+## printable 4-grams would need 95**4 floats (over 300MB), so by default
+## printable tables are built up to order 3 only
+##
+## load_table memory-maps a table instead of reading it in, so it is ready
+## at once however big it is, and worker processes share the same pages.
+## the tables are written in this machine's byte order
+##
+## usage: python ngram_model.py corpus.txt [more.txt ...]
+
+import heapq
+import mmap
+import os
+import sys
+from array import array
+from collections import Counter
+from math import exp, log
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ngram_models")
+
+ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+## number of symbols in each alphabet
+SIZES = {"letters": 26, "printable": 95}
+
+## bytes translation tables from byte value to symbol code, 255 for bytes
+## that are dropped
+CODES = {
+    "letters": bytes(ALPHABET.index(chr(b).upper()) if chr(b).upper() in ALPHABET
+                     else 255 for b in range(256)),
+    "printable": bytes(b-32 if 32 <= b < 127 else 0 if chr(b) in "\t\n\r\f\v"
+                       else 255 for b in range(256)),
+    }
+
+## the symbol each code stands for, in each alphabet
+SYMBOLS = {"letters": ALPHABET,
+           "printable": "".join(chr(b) for b in range(32, 127))}
+
+## english letter, bigram and trigram frequencies expressed as percentages,
+## used when no model has been built
+UNSORTED_ENG_FREQ = [('A', 8.55), ('B', 1.60), ('C',3.16), ('D', 3.87), ('E', 12.1),
+            ('F', 2.18), ('G', 2.09), ('H', 4.96), ('I', 7.33), 
+            ('J', 0.22), ('K', 0.81), ('L', 4.21), ('M', 2.53),
+            ('N', 7.17), ('O',7.47), ('P',2.07), ('Q', 0.10),
+            ('R', 6.33), ('S', 6.73), ('T', 8.94), ('U', 2.68),
+            ('V', 1.06), ('W', 1.83), ('X',0.19), ('Y',1.72), ('Z', 0.11)
+            ]
+
+ENG_BIGRAM_FREQ = [('TH',2.71), ('HE', 2.33), ('IN', 2.03), ('ER', 1.78),
+                   ('AN', 1.61), ('RE', 1.41), ('ES', 1.32), 
+                   ('ON', 1.32), ('ST', 1.25), ('NT', 1.17),
+                   ('EN', 1.12), ('AT', 1.12), ('ED', 1.08), ('ND', 1.07),
+                   ('TO', 1.07), ('OR', 1.06), ('EA', 1.00),
+                   ]
+
+ENG_TRIGRAM_FREQ = [('THE',1.81), ('AND', 0.73), ('ING', 0.72), ('ENT', 0.42),
+                   ('ION', 0.42), ('HER', 0.36), ('FOR', 0.34), ('THA', 0.33),
+                   ('NTH', 0.33),('INT', 0.32),('ERE', 0.31),('TIO', 0.31), ('TER', 0.30),
+                   ('EST', 0.28), ('ERS', 0.28)
+                   ]
+
+TABLES = {}   # (alphabet, n, model_dir) --> table, once loaded
+
+
+def encode(data, alphabet):
+    """
+    data is a bytes object
+    alphabet is "letters" or "printable"
+    returns a bytes object, the codes of the symbols in data
+    """
+    return data.translate(CODES[alphabet]).replace(b"\xff", b"")
+
+def encode_letters(txt):
+    """
+    txt is a string
+    returns a bytes object, the 0-25 index of each letter in txt 
+    (either case), with everything else dropped
+    """
+    return encode(txt.encode('latin-1', 'replace'), "letters")
+
+class NgramCounts(object):
+    def __init__(self, n, txt="", alphabet="letters"):
+        """
+        n is the number of sequential symbols to count, eg
+        n=1 for single letters, n=2 for digrams, n=3 for trigrams
+        txt is an optional string to start counting with (see add)
+        alphabet is "letters" or "printable"
+
+        n-grams are counted by a Counter over n staggered slices of the 
+        codes zipped together, so the counting loop runs in C
+        """
+        self.n = n
+        self.alphabet = alphabet
+        self.counts = Counter()   # tuple of n codes --> count
+        self.tail = b""    # last n-1 codes added, to join on to the next text
+        self.add(txt)
+
+    def add(self, txt):
+        """
+        txt is a string, the next part of the text being counted
+        (symbols not in the alphabet are ignored)
+
+        counts the n-grams in txt, including those that run on from 
+        the end of the text added before, so a big text can be added 
+        a piece at a time and the counts are the same
+        """
+        self.add_vals( encode(txt.encode('latin-1', 'replace'), self.alphabet) )
+
+    def add_vals(self, vals):
+        """
+        vals is a bytes object of codes, as from encode
+        counts them as add does for text
+        """
+        vals = self.tail + vals
+        self.counts.update( zip(*[vals[i:] for i in range(self.n)]) )
+        self.tail = vals[-(self.n-1):] if self.n > 1 else b""
+
+    def total(self):
+        """
+        returns the total number of n-grams counted
+        """
+        return sum(self.counts.values())
+
+    def __add__(self, other):
+        """
+        other is an NgramCounts for the same n, eg for another shard of a corpus
+        returns a new NgramCounts with the counts of both
+        (n-grams that span the join between the shards are not counted)
+        """
+        assert self.n == other.n and self.alphabet == other.alphabet
+        merged = NgramCounts(self.n, alphabet=self.alphabet)
+        merged.counts = self.counts + other.counts
+        merged.tail = other.tail
+        return merged
+
+    def symbols(self, ngram):
+        """
+        ngram is a tuple of codes
+        returns the string of symbols it stands for
+        """
+        return "".join(SYMBOLS[self.alphabet][v] for v in ngram)
+
+    def most_common(self, k=None):
+        """
+        k is the number of n-grams wanted (default: all of them)
+        returns a list of ('NGRAM', count) tuples, sorted descending
+        (the top k are picked out with a heap rather than a full sort)
+        """
+        return [ (self.symbols(ngram), c) for ngram, c in self.counts.most_common(k) ]
+
+    def freqs(self, k=None, tot=None):
+        """
+        k is the number of n-grams wanted (default: all of them)
+        tot is the number to divide by (default: the total number of n-grams)
+
+        returns a list of tuples ('NGRAM', freq) formatted as UNSORTED_ENG_FREQ,
+        the percentage frequencies rounded to 2 places, sorted descending.
+        n-grams with the same rounded frequency stay in the order they 
+        were first seen
+        """
+        if tot is None:
+            tot = self.total()
+
+        ngrams = ( (self.symbols(ngram), round(100*(c/tot), 2))
+                   for ngram, c in self.counts.items() )
+        if k is None:
+            return sorted(ngrams, key=lambda x:x[1], reverse=True)
+        return heapq.nlargest(k, ngrams, key=lambda x:x[1])
+
+def count_corpus(paths, alphabet, orders, chunksize=2**24):
+    """
+    paths is a list of names of plaintext files
+    alphabet is "letters" or "printable"
+    orders are the values of n to count
+    chunksize is the number of bytes read at a time
+
+    returns a dict mapping n --> NgramCounts for the whole corpus.
+    n-grams that run over from one chunk to the next are counted,
+    but not ones that run from one file to the next
+    """
+    counts = {n: NgramCounts(n, alphabet=alphabet) for n in orders}
+
+    for path in paths:
+        shard = {n: NgramCounts(n, alphabet=alphabet) for n in orders}
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(chunksize)
+                if not chunk:
+                    break
+                codes = encode(chunk, alphabet)
+                for n in orders:
+                    shard[n].add_vals(codes)
+
+        for n in orders:
+            counts[n] = counts[n] + shard[n]
+
+    return counts
+
+def gen_table(counts, size, n):
+    """
+    counts is a Counter of tuples of n codes --> count
+    size is the number of symbols in the alphabet
+    n is the order of the n-grams
+
+    returns an array of size**n float32s, the log probability of each
+    n-gram. n-grams never seen get log(0.01/total)
+    """
+    tot = sum(counts.values())
+    table = array('f', [log(0.01/tot)]) * size**n
+    for ngram, c in counts.items():
+        if c > 0:
+            i = 0
+            for code in ngram:
+                i = i*size + code
+            table[i] = log(c/tot)
+    return table
+
+def table_path(alphabet, n, model_dir=MODEL_DIR):
+    """
+    returns the name of the file the order n table for alphabet is kept in
+    """
+    return os.path.join(model_dir, alphabet + "_" + str(n) + ".f32")
+
+def build_models(paths, model_dir=MODEL_DIR, letter_orders=(1, 2, 3, 4),
+                 printable_orders=(1, 2, 3)):
+    """
+    paths is a list of names of plaintext files, the corpus
+    model_dir is the directory to write the tables to
+    letter_orders and printable_orders are the values of n to build
+    tables for, for each alphabet
+
+    returns a list of the names of the files written
+    """
+    os.makedirs(model_dir, exist_ok=True)
+    written = []
+
+    for alphabet, orders in [("letters", letter_orders), ("printable", printable_orders)]:
+        if not orders:
+            continue
+        counts = count_corpus(paths, alphabet, orders)
+        for n in orders:
+            path = table_path(alphabet, n, model_dir)
+            with open(path, 'wb') as f:
+                gen_table(counts[n].counts, SIZES[alphabet], n).tofile(f)
+            written.append(path)
+
+    return written
+
+def load_table(alphabet, n, model_dir=MODEL_DIR):
+    """
+    alphabet is "letters" or "printable"
+    n is the order of the n-grams
+
+    returns the table (see gen_table) as a memoryview of floats over the
+    memory-mapped file, or None if it has not been built
+    raises ValueError if the file is not the right size for a table
+    """
+    key = (alphabet, n, model_dir)
+    if key not in TABLES:
+        path = table_path(alphabet, n, model_dir)
+        if not os.path.exists(path):
+            return None
+
+        with open(path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        table = memoryview(mm).cast('f')
+        if len(table) != SIZES[alphabet]**n:
+            raise ValueError(path + " is not an order " + str(n) + " " + alphabet + " table")
+        TABLES[key] = table
+
+    return TABLES[key]
+
+def byte_log_probs(floor=1e-9):
+    """
+    floor is the probability given to byte values that are not printable ascii
+
+    returns a list of 256 floats, the log probability of each byte value
+    in english plaintext, from the order 1 printable table if one has been
+    built, else from UNSORTED_ENG_FREQ with spaces and punctuation added 
+    (other printable values get a small probability)
+    """
+    probs = [floor]*256
+
+    table = load_table("printable", 1)
+    if table is not None:
+        for code, lp in enumerate(table):
+            probs[code+32] = exp(lp)
+    else:
+        for val in range(32, 127):
+            probs[val] = 1e-4
+        probs[ord(' ')] = 0.17
+        for c in ".,":
+            probs[ord(c)] = 0.01
+        for c in "'\"-;:!?()":
+            probs[ord(c)] = 0.002
+        for lett, f in UNSORTED_ENG_FREQ:
+            probs[ord(lett.lower())] = 0.75*f/100
+            probs[ord(lett)] = 0.03*f/100
+
+    tot = sum(probs)
+    return [log(p/tot) for p in probs]
+
+
+if __name__ == "__main__":
+    for path in build_models(sys.argv[1:]):
+        print("wrote", path)
@@ -12,8 +12,16 @@
 ## also int("0xff", 16) = 255
 # 
 #  
+import fcntl
+import json
+import mmap
+import os
+from bisect import bisect_left, insort
 from pydoc import plain
-from random import randint
+
+from break_onetimepad_assignment import recover_pad_key
+from hex_codec import vals_to_hexstring
+from key_material import random_bytes
 
 def string_to_vals(s):
     """
@@ -24,28 +32,13 @@ def string_to_vals(s):
     vals = [ord(c) for c in s]
     return vals
 
-def vals_to_hexstring(vals):
-    """
-    vals is a list ints, corresponding to byte values, in range 0->255
-    returns a string, the hexadecimal representation of those bytes
-    """
-    s = ""
-    for val in vals:
-        assert val >=0 and val <=255   # must represent a byte
-        hexval = hex(val)[2:]  #strip out leading '0x'
-        if len(hexval)==1:
-            hexval = '0'+ hexval  #and add leading zero if needed
-        s = s + hexval
-
-    return s
-
 def genkey(n):
     """
     n is an int, the length (number of bytes) of the key we want to generate
     returns the key as a list of ints, where each int is in the range 0-->255
 
     """
-    key = [randint(0, 255) for i in range(n)]
+    key = list( random_bytes(n) )  # from the OS secure generator, not randint
     return key
 
 def encrypt(plaintext):
@@ -63,5 +56,361 @@ def encrypt(plaintext):
     ciphvals = [plainvals[i]^keyvals[i] for i in range(n)]
 
     print("ciphertext is", vals_to_hexstring(ciphvals))
-    
-    
\ No newline at end of file
+
+
+## FILE MODE
+## large files are XORed with a pad file through memory maps, a block at a
+## time, each block as one big int, so nothing is ever held as a list of ints
+
+def xor_file_with_pad(inpath, outpath, padpath, offset=0, blocksize=2**24):
+    """
+    inpath is the name of the file to encrypt (or decrypt)
+    outpath is the name of the file to write the result to
+    padpath is the name of the pad file (see key_material.gen_pad_file)
+    offset is an int, the position in the pad of the first pad byte to use
+    blocksize is the number of bytes XORed at a time
+
+    XORs every byte i of inpath with pad byte offset+i
+    returns the number of bytes written
+    raises ValueError if the pad has fewer than offset+len(inpath) bytes,
+    or if outpath is inpath or the pad, as opening it for writing would 
+    empty it before it is read
+    """
+    if os.path.exists(outpath) and (os.path.samefile(inpath, outpath) or 
+                                    os.path.samefile(padpath, outpath)):
+        raise ValueError("outpath must not be the input file or the pad")
+
+    n = os.path.getsize(inpath)
+    if offset < 0 or offset + n > os.path.getsize(padpath):
+        raise ValueError("not enough pad left after offset " + str(offset))
+
+    with open(outpath, 'wb+') as fout:
+        fout.truncate(n)
+        if n == 0:
+            return 0
+
+        with open(inpath, 'rb') as fin, open(padpath, 'rb') as fpad, \
+             mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as m, \
+             mmap.mmap(fpad.fileno(), 0, access=mmap.ACCESS_READ) as p, \
+             mmap.mmap(fout.fileno(), n) as c:
+
+            for start in range(0, n, blocksize):
+                end = min(start+blocksize, n)
+                mvals = int.from_bytes(m[start:end], 'little')
+                kvals = int.from_bytes(p[offset+start:offset+end], 'little')
+                c[start:end] = (mvals ^ kvals).to_bytes(end-start, 'little')
+
+    return n
+
+def pad_id(padpath):
+    """
+    padpath is the name of a pad file
+    returns a tuple (device, inode) that identifies the pad file itself,
+    however the path to it is written (relative, absolute, via a link)
+    """
+    st = os.stat(padpath)
+    return (st.st_dev, st.st_ino)
+
+class PadLedger(object):
+    def __init__(self, path):
+        """
+        path is the name of the ledger file, which is created if needed
+
+        the ledger has one JSON line per pad byte range that has been used, 
+        {"pad": padpath, "dev": int, "ino": int, "start": int, "end": int, 
+        "id": msgid}, and lines are only ever appended, so it survives 
+        crashes and can be audited. ranges are kept by the pad's device and
+        inode (see pad_id), so one pad reached through different paths is
+        still one pad. padpath is the real path, kept for reading the ledger
+
+        several processes may share one ledger file. record and allocate 
+        hold an exclusive lock on it (fcntl.flock) and read any lines the 
+        others have appended before deciding which bytes are free
+        """
+        self.path = path
+        self.ranges = {}    # pad_id --> sorted list of (start, end, msgid)
+        self.pos = 0        # number of bytes of the ledger file read so far
+
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                self.load(f)
+
+    def load(self, f):
+        """
+        f is the ledger file, open for reading in binary mode
+
+        reads the lines appended since the last call into self.ranges.
+        a partly written last line is left for later, as another process 
+        may still be writing it. one left by a crash is cut off by the next
+        append, and skipped from then on
+        """
+        f.seek(self.pos)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            self.pos += len(line)
+            if line.strip():
+                try:
+                    r = json.loads(line)
+                except ValueError:
+                    continue
+                if "ino" in r:
+                    key = (r["dev"], r["ino"])
+                elif os.path.exists(r["pad"]):
+                    key = pad_id(r["pad"])   # written before pads were kept by inode
+                else:
+                    continue
+                insort(self.ranges.setdefault(key, []), (r["start"], r["end"], r["id"]))
+
+    def next_offset(self, padpath):
+        """
+        padpath is the name of a pad file
+        returns the offset just past the last used byte of the pad
+        """
+        used = self.ranges.get(pad_id(padpath), [])
+        return max( (end for start, end, msgid in used), default=0 )
+
+    def overlaps(self, padpath, start, end):
+        """
+        padpath is the name of a pad file
+        start and end are ints, a range of pad bytes (end excluded)
+        returns the list of recorded ranges (start, end, msgid) that share
+        any bytes with it
+        """
+        used = self.ranges.get(pad_id(padpath), [])
+        i = bisect_left(used, (end,))   # ranges from i on start at or after end
+        return [r for r in used[:i] if r[1] > start]
+
+    def append(self, f, padpath, start, end, msgid):
+        """
+        f is the ledger file, open for appending in binary mode and locked
+        padpath, start, end and msgid are as for record
+
+        checks the range against those already recorded, then adds it and 
+        flushes it to disk
+        raises ValueError if any of those bytes were already used
+        """
+        clash = self.overlaps(padpath, start, end)
+        if clash:
+            raise ValueError("pad bytes " + str(start) + "->" + str(end) + 
+                             " were already used for " + str([r[2] for r in clash]))
+
+        dev, ino = pad_id(padpath)
+        insort(self.ranges.setdefault((dev, ino), []), (start, end, msgid))
+        line = json.dumps({"pad": os.path.realpath(padpath), "dev": dev, "ino": ino,
+                           "start": start, "end": end, "id": msgid}) + "\n"
+        if f.seek(0, os.SEEK_END) > self.pos:
+            line = "\n" + line   # end a line left half written by a crash
+        f.write(line.encode())
+        f.flush()
+        os.fsync(f.fileno())
+        self.pos = f.tell()
+
+    def record(self, padpath, start, end, msgid):
+        """
+        padpath is the name of a pad file
+        start and end are ints, the range of pad bytes used (end excluded)
+        msgid is a string identifying the message they were used for
+
+        adds the range to the ledger and flushes it to disk
+        raises ValueError if any of those bytes were already used
+        """
+        with open(self.path, 'ab+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)   # released when f is closed
+            self.load(f)
+            self.append(f, padpath, start, end, msgid)
+
+    def allocate(self, padpath, n, msgid):
+        """
+        padpath is the name of a pad file
+        n is an int, the number of pad bytes needed
+        msgid is a string identifying the message they are for
+
+        records the next n unused bytes of the pad as used and
+        returns the offset of the first one
+        raises ValueError if the pad does not have n bytes left
+        """
+        with open(self.path, 'ab+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)   # released when f is closed
+            self.load(f)
+            start = self.next_offset(padpath)
+            if start + n > os.path.getsize(padpath):
+                raise ValueError("not enough pad left after offset " + str(start))
+            self.append(f, padpath, start, start+n, msgid)
+        return start
+
+def encrypt_file(inpath, outpath, padpath, ledger=None):
+    """
+    inpath is the name of the file to encrypt
+    outpath is the name of the file to write the ciphertext to
+    padpath is the name of the pad file
+    ledger is the PadLedger to take pad bytes from
+    (default: the ledger file next to the pad, padpath + ".ledger" with
+    any links in padpath followed)
+
+    encrypts with the next unused bytes of the pad. they are recorded in the
+    ledger as used by outpath before encrypting, so even if encryption fails 
+    part way those pad bytes are never used again
+
+    returns the pad offset used, which is needed to decrypt
+    """
+    if ledger is None:
+        ledger = PadLedger(os.path.realpath(padpath) + ".ledger")
+
+    offset = ledger.allocate(padpath, os.path.getsize(inpath), outpath)
+    xor_file_with_pad(inpath, outpath, padpath, offset)
+
+    return offset
+
+def decrypt_file(inpath, outpath, padpath, offset):
+    """
+    inpath is the name of the ciphertext file
+    outpath is the name of the file to write the plaintext to
+    padpath is the name of the pad file
+    offset is an int, the pad offset returned by encrypt_file
+    """
+    xor_file_with_pad(inpath, outpath, padpath, offset)
+
+
+## PAD REUSE DETECTION
+## ascii plaintext values are all < 0x80, so the top bit of every ciphertext 
+## byte is just the top bit of the pad byte. two messages encrypted from the
+## same pad offset therefore have the same top bits, whatever they say, 
+## while messages from different pad bytes agree on each bit only by chance
+
+## the fewest top bits two messages must share to be taken as reusing pad
+## bytes. with fewer, chance matches pile up over a large archive
+MIN_FINGERPRINT = 48
+
+## translation table keeping only the top bit of each byte
+TOP_BITS = bytes(b & 0x80 for b in range(256))
+
+def pad_fingerprint(cvals, prefix=64):
+    """
+    cvals is a bytes object (or list of ints), a ciphertext
+    prefix is an int, the number of leading bytes to look at
+
+    returns an int made of the top bit of each of the first prefix bytes, 
+    ie a hash of the pad bytes that encrypted them. it takes one mask of 
+    a big int, whatever the length of the message
+    """
+    head = bytes(cvals[:prefix])
+    return int.from_bytes(head, 'big') & int.from_bytes(b"\x80"*len(head), 'big')
+
+class ReuseIndex(object):
+    def __init__(self, levels=(48, 64, 128)):
+        """
+        levels are the prefix lengths fingerprinted (see pad_fingerprint).
+        each message is fingerprinted at every level it is long enough for,
+        and two messages are compared at the longest level both reach, so 
+        messages of different lengths still match. messages shorter than 
+        the lowest level are not indexed
+
+        a shared fingerprint only makes two messages candidates. they are 
+        joined into a group only if their top bits agree over the whole 
+        length they have in common, so chance matches of a prefix are not
+        chained together into large false groups
+        raises ValueError if a level is below MIN_FINGERPRINT
+        """
+        if min(levels) < MIN_FINGERPRINT:
+            raise ValueError("levels below " + str(MIN_FINGERPRINT) + " match by chance too often")
+        self.levels = sorted(levels)
+        self.buckets = {}   # (level, fingerprint) --> list of (msgid, top level)
+        self.tops = {}      # msgid --> top bits of each of its bytes (see TOP_BITS)
+        self.parent = {}    # msgid --> msgid, joining messages that share pad bytes
+
+    def find(self, msgid):
+        """
+        returns the msgid that stands for the group msgid is in
+        """
+        while self.parent[msgid] != msgid:
+            self.parent[msgid] = self.parent[self.parent[msgid]]
+            msgid = self.parent[msgid]
+        return msgid
+
+    def add(self, msgid, cvals):
+        """
+        msgid identifies the message
+        cvals is a bytes object (or list of ints), its ciphertext, or as 
+        much of the start of it as should be compared
+        returns the list of msgids already indexed that look like they 
+        were encrypted with the same pad bytes
+        """
+        levels = [level for level in self.levels if level <= len(cvals)]
+        if not levels:
+            return []
+        top = levels[-1]
+        tops = bytes(cvals).translate(TOP_BITS)
+
+        candidates = []
+        for level in levels:
+            bucket = self.buckets.setdefault( (level, pad_fingerprint(cvals, level)), [] )
+            ## below our top level, only messages that stop at this level 
+            ## are compared here; longer ones are compared at a higher level
+            candidates += [other for other, other_top in bucket if other_top == level or level == top]
+            bucket.append( (msgid, top) )
+
+        ## confirm each candidate over the full common length
+        matches = []
+        for other in candidates:
+            other_tops = self.tops[other]
+            common = min(len(tops), len(other_tops))
+            if tops[:common] == other_tops[:common]:
+                matches.append(other)
+
+        self.tops[msgid] = tops
+        self.parent[msgid] = msgid
+        for other in matches:
+            self.parent[self.find(other)] = self.find(msgid)
+
+        return matches
+
+    def groups(self):
+        """
+        returns a list of lists of msgids, each list a group of two or more
+        messages that look like they were encrypted with the same pad bytes
+        """
+        groups = {}
+        for msgid in self.parent:
+            groups.setdefault(self.find(msgid), []).append(msgid)
+        return [msgids for msgids in groups.values() if len(msgids) > 1]
+
+    def audit(self, load):
+        """
+        load is a function that takes a msgid and returns its ciphertext
+        
+        runs recover_pad_key (the break_ciphs logic) on every group of 
+        messages that share pad bytes, to show how much of the pad, and so
+        of those messages, an attacker could recover
+
+        returns a list of (msgids, key) tuples, where key is the list of 
+        recovered keybytes over the common length of the group, 0 if unknown
+        """
+        results = []
+        for msgids in self.groups():
+            ciphs = [bytes(load(msgid)) for msgid in msgids]
+            mlen = min(len(ciph) for ciph in ciphs)
+            key = recover_pad_key([ciph[:mlen] for ciph in ciphs])
+            results.append( (msgids, key) )
+        return results
+
+def audit_files(paths, levels=(48, 64, 128), compare=4096):
+    """
+    paths is a list of names of ciphertext files (eg written by encrypt_file)
+    levels are the prefix lengths fingerprinted (see ReuseIndex)
+    compare is the number of leading bytes of each file compared to 
+    confirm a match
+
+    indexes every file and audits the groups that reused pad bytes
+    returns the result of ReuseIndex.audit
+    """
+    index = ReuseIndex(levels)
+    for path in paths:
+        with open(path, 'rb') as f:
+            index.add(path, f.read(max(max(levels), compare)))
+
+    def load(path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    return index.audit(load)
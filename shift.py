@@ -5,10 +5,34 @@ Created on Sun Mar 27 15:19:14 2022
 @author: Anna
 """
 
+import csv
+import os
+from itertools import islice
+from math import log
+from multiprocessing import Pool
+
+from ngram_model import UNSORTED_ENG_FREQ, encode_letters, load_table
+
 CIPHER = "OVDTHUFWVZZPISLRLFZHYLAOLYL"
 
 ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
 
+## log of the english letter frequencies, in ALPHABET order, from the 
+## letters model if one has been built (see ngram_model)
+ENG_LOG_FREQ = load_table("letters", 1)
+if ENG_LOG_FREQ is None:
+    ENG_LOG_FREQ = [log(f/100) for (lett, f) in UNSORTED_ENG_FREQ]
+ENG_LOG_FREQ = list(ENG_LOG_FREQ)
+
+## lookup tables for every shift, SHIFT_TABLES[k] maps each uppercase 
+## ciphertext letter to its lowercase plaintext letter for shift key k
+SHIFT_TABLES = [str.maketrans(ALPHABET, (ALPHABET[k:] + ALPHABET[:k]).lower())
+                for k in range(26)]
+
+## SCORE_ROWS[i][k] is the log english freq of the plaintext letter that 
+## ciphertext letter i decrypts to under shift key k
+SCORE_ROWS = [tuple(ENG_LOG_FREQ[(i+k)%26] for k in range(26)) for i in range(26)]
+
 
 def decrypt(msg, k):
     """
@@ -23,25 +47,121 @@ def decrypt(msg, k):
                 
     """
     
-    plaintxt = ""
+    return msg.translate(SHIFT_TABLES[k%26])
+
+def decrypt_all(msg):
+    """
+    msg is a string, the (uppercase) ciphertext to decrypt
+    returns a list of 26 strings, where the string at index k
+    is msg decrypted with shift key k
+    """
+    return [msg.translate(table) for table in SHIFT_TABLES]
+
+def score_shifts(msg):
+    """
+    msg is a string, the (uppercase) ciphertext to score
+
+    each ciphertext letter is turned into its row of SCORE_ROWS, giving 
+    an N x 26 table, and summing down the columns gives the log likelihood
+    of the decryption under every shift key k at once, without building 
+    any candidate plaintext
+
+    returns a list of 26 (k, score) tuples sorted from most to least 
+    likely key
+    """
+    codes = encode_letters(msg)   # non letters do not count towards the score
+    rows = map(SCORE_ROWS.__getitem__, codes)
+
+    scores = list( enumerate(map(sum, zip(*rows))) )
+    if len(scores) == 0:   ## empty msg, every key is as good as any other
+        scores = [(k, 0.0) for k in range(26)]
+
+    return sorted(scores, key=lambda item:item[1], reverse=True)
+
+def crack(msg):
+    """
+    msg is a string, the ciphertext to break (either case, it is scored and
+    decrypted as uppercase, by the convention decrypt follows)
+    returns a tuple (k, score, plaintext) for the most likely shift key
+    """
+    msg = msg.upper()
+    k, score = score_shifts(msg)[0]
+    return (k, score, decrypt(msg, k))
+
+def crack_all(msgs):
+    """
+    msgs is an iterable of ciphertext strings (either case, as for crack)
+    yields a (k, score, plaintext) tuple for each one, in order
+    """
+    for msg in msgs:
+        yield crack(msg)
+
+def read_corpus(src):
+    """
+    src is the path of a newline-delimited file of ciphertexts, or of a 
+    directory of such files
+    
+    yields (id, ciphertext) tuples one line at a time, so the corpus is never
+    held in memory. the id is "filename:lineno", blank lines are skipped
+    """
+    if os.path.isdir(src):
+        paths = sorted( os.path.join(src, name) for name in os.listdir(src) )
+        paths = [p for p in paths if os.path.isfile(p)]
+    else:
+        paths = [src]
+
+    for path in paths:
+        name = os.path.basename(path)
+        with open(path, encoding='ascii', errors='replace') as f:
+            for lineno, line in enumerate(f, 1):
+                msg = line.strip().upper()
+                if msg:
+                    yield (name + ":" + str(lineno), msg)
+
+def triage_one(item):
+    """
+    item is an (id, ciphertext) tuple
+    returns an (id, best_shift, score, plaintext) record
+    """
+    msgid, msg = item
+    k, score, plaintext = crack(msg)
+    return (msgid, k, score, plaintext)
+
+def triage_corpus(src, outpath, processes=None, batch_size=10000):
+    """
+    src is a ciphertext file or directory, as for read_corpus
+    outpath is the path of the file to write results to
+    processes is the number of worker processes (default: one per cpu)
+    batch_size is the number of ciphertexts handed to the pool at a time
+
+    cracks every ciphertext in src across a process pool and writes one
+    tab separated record   id  best_shift  score  plaintext   per ciphertext,
+    in corpus order. the records are written with csv.writer, so a field 
+    holding a tab, quote or newline is quoted and the file reads back with
+    csv.reader(f, delimiter='\t'). only one batch is held in memory at a 
+    time and each batch is flushed to outpath as soon as it is done
+
+    returns the number of ciphertexts processed
+    """
+    corpus = read_corpus(src)
+    tot = 0
     
-    for char in msg:
-        i = ALPHABET.index(char)
-       
-        i_new = (i+k)%26
-        
-        plaintxt = plaintxt + ALPHABET[i_new].lower()
-        
-    return plaintxt
+    with Pool(processes) as pool, open(outpath, 'w', newline='') as out:
+        writer = csv.writer(out, delimiter='\t', lineterminator='\n')
+        while True:
+            batch = list(islice(corpus, batch_size))
+            if not batch:
+                break
+
+            for msgid, k, score, plaintext in pool.imap(triage_one, batch, 256):
+                writer.writerow( (msgid, k, round(score, 3), plaintext) )
+            out.flush()
+            tot += len(batch)
+
+    return tot
 
 def test():
     print("cipher=", CIPHER)
-    for k in range(26):
-        print("\ntrying key ", k)
+    for k, score in score_shifts(CIPHER):
+        print("\ntrying key ", k, "score", round(score, 2))
         print(decrypt(CIPHER, k))
-             
-        
-    
-        
-    
-    
\ No newline at end of file
@@ -15,6 +15,18 @@ Decrypted text
 CRYPTOGRAPHICSYSTEMSAREEKTREMELYDIFFICULTTOBUILDNEVERTHELESSFORSOMEREASONMANYNONEKPERTSINSISTONDESIGNINGNEWENCRYPTIONSCHEMESTHATSEEMTOTHEMTOBEMORESECURETHANANYOTHERSCHEMEONEARTHTHEUNFORTUNATETRUTHHOWEVERISTHATSUCHSCHEMESAREUSUALLYTRIVIALTOBREAJ
 """
 
+import heapq
+import os
+from array import array
+from collections import Counter
+from functools import partial
+from math import log10
+from multiprocessing import Pool
+from random import Random
+
+from ngram_model import (ENG_BIGRAM_FREQ, ENG_TRIGRAM_FREQ, UNSORTED_ENG_FREQ,
+                         NgramCounts, encode_letters, load_table)
+
 CIPHER = "JGRMQOYGHMVBJWRWQFPWHGFFDQGFPFZRKBEEBJIZQQOCIBZKLFAFGQVFZFWWE\
 OGWOPFGFHWOLPHLRLOLFDMFGQWBLWBWQOLKFWBYLBLYLFSFLJGRMQBOLWJVFP\
 FWQVHQWFFPQOQVFPQOCFPOGFWFJIGFQVHLHLROQVFGWJVFPFOLFHGQVQVFILE\
@@ -28,94 +40,73 @@ PPXLIECCIEVEWGISJKTVWMRLIHYSPHXLIQIMYLXSJXLIMWRIGXQEROIVFVIZEVAEKPIEWHXEAMWYEPP\
 XLMWYRMWXSGSWRMHIVEXMSWMGSTPHLEVHPFKPEZINTCMXIVJSVLMRSCMWMSWVIRCIGXMWYMX"
 
 
-UNSORTED_ENG_FREQ = [('A', 8.55), ('B', 1.60), ('C',3.16), ('D', 3.87), ('E', 12.1),
-            ('F', 2.18), ('G', 2.09), ('H', 4.96), ('I', 7.33), 
-            ('J', 0.22), ('K', 0.81), ('L', 4.21), ('M', 2.53),
-            ('N', 7.17), ('O',7.47), ('P',2.07), ('Q', 0.10),
-            ('R', 6.33), ('S', 6.73), ('T', 8.94), ('U', 2.68),
-            ('V', 1.06), ('W', 1.83), ('X',0.19), ('Y',1.72), ('Z', 0.11)
-            ]
-
 ENG_FREQ = sorted(UNSORTED_ENG_FREQ, key=lambda item:item[1], reverse=True)
 
-ENG_BIGRAM_FREQ = [('TH',2.71), ('HE', 2.33), ('IN', 2.03), ('ER', 1.78),
-                   ('AN', 1.61), ('RE', 1.41), ('ES', 1.32), 
-                   ('ON', 1.32), ('ST', 1.25), ('NT', 1.17),
-                   ('EN', 1.12), ('AT', 1.12), ('ED', 1.08), ('ND', 1.07),
-                   ('TO', 1.07), ('OR', 1.06), ('EA', 1.00),
-                   ]
+ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
 
-ENG_TRIGRAM_FREQ = [('THE',1.81), ('AND', 0.73), ('ING', 0.72), ('ENT', 0.42),
-                   ('ION', 0.42), ('HER', 0.36), ('FOR', 0.34), ('THA', 0.33),
-                   ('NTH', 0.33),('INT', 0.32),('ERE', 0.31),('TIO', 0.31), ('TER', 0.30),
-                   ('EST', 0.28), ('ERS', 0.28)
-                   ]
+## N-GRAM STATISTICS
+## the counting is done by ngram_model.NgramCounts, which encodes the text
+## to letter indexes once and counts every n-gram in one pass in C
 
-ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+def count_ngrams(txt, orders=(1, 2, 3, 4)):
+    """
+    txt is a string (non letters are ignored)
+    orders are the values of n to count
+    returns a dict mapping n --> NgramCounts for txt
+    """
+    vals = encode_letters(txt)   # once, for all the orders
+    ret = {}
+    for n in orders:
+        ret[n] = NgramCounts(n)
+        ret[n].add_vals(vals)
+    return ret
 
-def get_lett_freq(txt):
+def test_ngram_counts(txt=CIPHER2):
+    """
+    txt is a string to count
+
+    checks that adding txt to an NgramCounts a piece at a time, for pieces
+    of every size from 1 letter up, gives the same counts as adding it whole
+    """
+    for n in (1, 2, 3, 4):
+        whole = NgramCounts(n, txt).counts
+        for size in range(1, n+3):
+            pieces = NgramCounts(n)
+            for i in range(0, len(txt), size):
+                pieces.add(txt[i:i+size])
+            assert pieces.counts == whole, (n, size)
+
+def get_lett_freq(txt, k=None):
     """
     txt is a string, all caps, no spaces or punctuation
+    k is the number of letters wanted (default: all 26)
     returns a list of tuples formatted as ENG_FREQ representing the percentage
     letter frequencies in txt, sorted descending
     """
-    
-    # convert txt to upper case
-    txt = txt.upper()
+    counts = NgramCounts(1, txt).counts
     
     tot = len(txt)
     
-    # compile a dictionary of letter counts 
-    ret=[]
-    
-    for letter in ALPHABET:
-        freq = 100*( txt.count(letter) )/tot  # letter freq as percentage
+    ret = [ (letter, round(100*counts[(i,)]/tot, 2)) for i, letter in enumerate(ALPHABET) ]
         
-        ret.append( (letter, round(freq, 2)) )
-        
-    ret = sorted(ret,  key=lambda item:item[1], reverse=True)   
-    return ret
+    if k is None:
+        return sorted(ret,  key=lambda item:item[1], reverse=True)   
+    return heapq.nlargest(k, ret, key=lambda item:item[1])
         
 
-def get_ngram_freq(txt, n):
+def get_ngram_freq(txt, n, k=None):
     """ txt is a string, all caps, no spaces or punctuation
         (that is, containing only chars in ALPHABET)
         n is the number of sequential letters to consider, eg
         n=1 for single letters, n=2 for digrams, n=3 for trigrams
+        k is the number of n-grams wanted (default: all of them)
         
         returns a list of tuples ('ngram', int), formatted as ENG_LETTER_FREQ
         the percentage n-gram frequencies in txt, sorted descending
     """
-    d = {}
-    
     assert len(txt) >= n  # message must have at least n letters
-    
-
-
-    ## accumulate ngram counts    
-    for i in range( len(txt)-n+1 ):
-        ngram = txt[i:i+n]
-        
-        if ngram not in d:
-            d[ngram] = 0
-        d[ngram]+=1
-        
-    ## turn occurrence counts into frequencies
-    
-    tot = len(txt) - n + 1  # tot number of mgrams in msg 
-    
-    for ngram in d:
-        freq = round( 100*(d[ngram] / tot), 2 ) 
-        d[ngram] = freq
 
-        
-    ## turn them into sorted list of tuples
-    ngrams = d.items() 
-    ngrams = sorted(ngrams,  key=lambda x:x[1], reverse=True)   
-    
-
-    
-    return ngrams
+    return NgramCounts(n, txt).freqs(k)
 
 def gen_freq_table(ciph, eng):
     """
@@ -152,6 +143,8 @@ def analyse(msg, sd={}):
     
     print("substitution dictionary", sd, "\n")
 
+    sd = SubstitutionKey(sd)   # built once for all the tables
+
     
     ## get ciphertext letter frequencies & print freq table
     ciph_freq = get_lett_freq(msg)
@@ -160,12 +153,13 @@ def analyse(msg, sd={}):
 
     
     ## get ciphertext bigram frequencies & print table 
-    ciph_bigram_freq = get_ngram_freq(msg,2)  
+    ## (only as many rows as the english table has are shown)
+    ciph_bigram_freq = get_ngram_freq(msg, 2, len(ENG_BIGRAM_FREQ))  
     bigram_table = gen_freq_table(ciph_bigram_freq, ENG_BIGRAM_FREQ)
     print( substitute(bigram_table, sd) )
                
     ## get ciphertext trigram frequencies & print table
-    ciph_trigram_freq = get_ngram_freq(msg,3)
+    ciph_trigram_freq = get_ngram_freq(msg, 3, len(ENG_TRIGRAM_FREQ))
     trigram_table = gen_freq_table(ciph_trigram_freq, ENG_TRIGRAM_FREQ) 
     print( substitute(trigram_table, sd) )
 
@@ -174,26 +168,395 @@ def analyse(msg, sd={}):
            
 
                 
+class SubstitutionKey(object):
+    def __init__(self, d):
+        """
+        d is a substitution dictionary that maps single characters to
+        strings, eg CIPHLETTER (uppercase) --> ENGLETTER (lowercase)
+
+        the translation table is built once here, so the key can be 
+        applied to any number of texts in a single pass each
+        """
+        self.d = dict(d)
+        self.table = str.maketrans(self.d)
+
+    @classmethod
+    def from_string(cls, key, lower=True):
+        """
+        key is a string of 26 letters, a decryption key like 
+        VIBKFERAUCDNPQOMTYWXZHSJGL where the ith letter is the plaintext 
+        for the ith letter of ALPHABET
+        lower is True to map to lower case plaintext, as substitute does
+
+        returns the SubstitutionKey for it
+        """
+        assert len(key) == 26
+        if lower:
+            key = key.lower()
+        return cls( zip(ALPHABET, key) )
+
+    def apply(self, txt):
+        """
+        txt is a string
+        returns txt with every character in the key substituted
+        """
+        return txt.translate(self.table)
+
+    def inverse(self):
+        """
+        returns the SubstitutionKey that undoes this one, eg 
+        ENGLETTER --> CIPHLETTER for a decryption key
+        raises ValueError if two characters map to the same string
+        """
+        inv = {v: k for k, v in self.d.items()}
+        if len(inv) != len(self.d):
+            raise ValueError("key is not one to one, it cannot be inverted")
+        return SubstitutionKey(inv)
+
+    def compose(self, other):
+        """
+        other is a SubstitutionKey (or substitution dictionary) for single
+        characters
+        returns the SubstitutionKey that applies this key and then other
+        """
+        if not isinstance(other, SubstitutionKey):
+            other = SubstitutionKey(other)
+
+        d = { c: other.d.get(c, c) for c in other.d }
+        d.update( (c, other.apply(v)) for c, v in self.d.items() )
+        return SubstitutionKey(d)
+
+    def __str__(self):
+        return "".join( self.d.get(c, c) for c in ALPHABET )
+
 def substitute(ciphtxt, d):
     """
     ciphtxt is a string, the (uppercase) ciphertext to decode
     d is a substition dictionary that maps 
     CIPHLETTER (uppercase)-- > ENGLETTER (lowercase)
+    (or a SubstitutionKey, which is quicker when it is reused)
     
     applies the dictionary and returns the result
     """
-    # print("ciphertext is\n", ciphtxt)
-    # print("applying substitution dictionary", d)
-    result = ciphtxt
-    
-    for lett in d:
-        result = result.replace(lett, d[lett])
+    if not isinstance(d, SubstitutionKey):
+        d = SubstitutionKey(d)
 
-        
-    return result
+    return d.apply(ciphtxt)
+
+
+## AUTOMATIC SOLVER
+## hill climbing over decryption keys: start from a key, try swapping the 
+## plaintext letters of every pair of ciphertext letters, and keep any swap 
+## that makes the text look more like english, until no swap helps.
+## a key is scored by the sum of log10 probabilities of every 4 letter 
+## sequence (quadgram) in the text it decrypts to
+
+def count_quadgrams(txt):
+    """
+    txt is a string of english text, eg a book
+    returns a Counter mapping quadgram index (see gen_quadgram_table) --> count
+    for every run of 4 letters, ignoring case, spaces and punctuation
+    """
+    counts = NgramCounts(4, txt).counts
+    return Counter( {((a*26+b)*26+c)*26+d: n for (a,b,c,d), n in counts.items()} )
+
+def read_quadgram_counts(path):
+    """
+    path is the name of a quadgram count file, with lines like
+        TION 13168375
+    returns a Counter mapping quadgram index --> count
+    """
+    counts = Counter()
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                quad, n = line.split()
+                a,b,c,d = encode_letters(quad)
+                counts[((a*26+b)*26+c)*26+d] += int(n)
+    return counts
+
+def gen_quadgram_table(counts):
+    """
+    counts is a Counter mapping quadgram index --> count
+
+    returns an array of 26**4 floats, the log10 probability of each 
+    quadgram, where the quadgram ABCD is at index ((A*26+B)*26+C)*26+D
+    and A->Z are 0->25. quadgrams never seen get log10(0.01/total)
+    """
+    tot = sum(counts.values())
+    table = array('d', [log10(0.01/tot)]) * 26**4
+    for i, n in counts.items():
+        table[i] = log10(n/tot)
+    return table
+
+## quadgram counts from Newton's Opticks (Project Gutenberg), used when no 
+## other text or counts are given
+QUADGRAM_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "english_quadgrams.txt")
+
+QUADGRAMS = None   # built on first use by get_quadgram_table
+
+def get_quadgram_table(path=None):
+    """
+    path is the name of a quadgram count file (see read_quadgram_counts),
+    or of a plain english text to count quadgrams in
+    (default: the letters model if one has been built (see ngram_model), 
+    else QUADGRAM_FILE, or if that is missing, the python documentation 
+    topics that ship with python)
+
+    returns the quadgram table (see gen_quadgram_table), which is 
+    built once and then reused. the model holds natural logs rather 
+    than log10, which ranks keys just the same
+    """
+    global QUADGRAMS
+
+    if path is None:
+        if QUADGRAMS is not None:
+            return QUADGRAMS
+        QUADGRAMS = load_table("letters", 4)   # memory-mapped, shared by workers
+        if QUADGRAMS is not None:
+            return QUADGRAMS
+        if os.path.exists(QUADGRAM_FILE):
+            path = QUADGRAM_FILE
+
+    if path is None:
+        from pydoc_data.topics import topics
+        QUADGRAMS = gen_quadgram_table( count_quadgrams(" ".join(topics.values())) )
+    else:
+        with open(path) as f:
+            first = f.readline().split()
+        if len(first) == 2 and first[1].isdigit():
+            QUADGRAMS = gen_quadgram_table( read_quadgram_counts(path) )
+        else:
+            with open(path) as f:
+                QUADGRAMS = gen_quadgram_table( count_quadgrams(f.read()) )
+
+    return QUADGRAMS
+
+def gen_swap_starts(cvals):
+    """
+    cvals is a bytes object, the ciphertext letter indexes
+
+    returns a dict mapping each pair (x, y) of ciphertext letters, x < y, 
+    to the sorted list of positions of the quadgrams that contain x or y, 
+    ie the only quadgrams whose score changes when their plaintext 
+    letters are swapped
+    """
+    last = len(cvals) - 4    # position of the last quadgram
+    starts = [set() for x in range(26)]
+    for i, x in enumerate(cvals):
+        starts[x].update( range(max(0, i-3), min(i, last)+1) )
+
+    return { (x, y): sorted(starts[x] | starts[y]) 
+             for x in range(26) for y in range(x+1, 26) if starts[x] or starts[y] }
+
+def climb(cvals, dec, table, swaps, where):
+    """
+    cvals is a bytes object, the ciphertext letter indexes
+    dec is a list mapping ciphertext letter index --> plaintext letter index, 
+    the key to climb from, which is changed in place
+    table is the quadgram table
+    swaps is gen_swap_starts(cvals)
+    where is a list of the positions of each ciphertext letter in cvals
+
+    makes every swap of two letters of dec that improves the score, until 
+    none does. only the quadgrams touching a swapped letter are rescored, 
+    so each swap costs time in proportion to how often those letters occur
+
+    returns the score of the final dec
+    """
+    p = [dec[x] for x in cvals]   # plaintext letter indexes
+    qscores = [table[((p[i]*26+p[i+1])*26+p[i+2])*26+p[i+3]] for i in range(len(p)-3)]
+    score = sum(qscores)
+
+    improved = True
+    while improved:
+        improved = False
+        for (x, y), starts in swaps.items():
+            a, b = dec[x], dec[y]
+
+            for i in where[x]:
+                p[i] = b
+            for i in where[y]:
+                p[i] = a
+
+            old = 0.0
+            new = 0.0
+            for i in starts:
+                old += qscores[i]
+                new += table[((p[i]*26+p[i+1])*26+p[i+2])*26+p[i+3]]
+
+            if new > old:
+                dec[x], dec[y] = b, a
+                for i in starts:
+                    qscores[i] = table[((p[i]*26+p[i+1])*26+p[i+2])*26+p[i+3]]
+                score += new - old
+                improved = True
+            else:   # put them back
+                for i in where[x]:
+                    p[i] = a
+                for i in where[y]:
+                    p[i] = b
+
+    return score
+
+TEXT_INDEX = (None, None)   # (cvals, index) of the text last indexed by get_text_index
+
+def get_text_index(cvals):
+    """
+    cvals is a bytes object, the ciphertext letter indexes
+
+    returns a tuple (swaps, where), where swaps is gen_swap_starts(cvals) 
+    and where is a list of the positions of each ciphertext letter in cvals.
+    they depend only on the text, so they are built once and reused for 
+    every climb of the same text, in this process and in any worker 
+    processes forked after it was indexed
+    """
+    global TEXT_INDEX
+
+    if TEXT_INDEX[0] != cvals:
+        where = [[] for x in range(26)]     # positions of each ciphertext letter
+        for i, x in enumerate(cvals):
+            where[x].append(i)
+        TEXT_INDEX = (cvals, (gen_swap_starts(cvals), where))
+
+    return TEXT_INDEX[1]
+
+def hill_climb(cvals, seed, table=None, index=None):
+    """
+    cvals is a bytes object, the ciphertext letter indexes (at least 4)
+    seed is the seed for the random starting key
+    table is the quadgram table (default: get_quadgram_table())
+    index is get_text_index(cvals), which it defaults to
+
+    climbs from a random key until no swap of two letters improves it
+
+    returns a tuple (score, dec), where dec is a list mapping ciphertext 
+    letter index --> plaintext letter index
+    """
+    if table is None:
+        table = get_quadgram_table()
+    if index is None:
+        index = get_text_index(cvals)
+    swaps, where = index
+
+    dec = list(range(26))
+    Random(seed).shuffle(dec)
+    score = climb(cvals, dec, table, swaps, where)
+
+    return (score, dec)
+
+def dec_to_key(dec):
+    """
+    dec is a list mapping ciphertext letter index --> plaintext letter index
+    returns the decryption key as a string, like VIBKFERAUCDNPQOMTYWXZHSJGL,
+    where the ith letter is the plaintext for the ith letter of ALPHABET
+    """
+    return "".join(ALPHABET[v] for v in dec)
+
+def solve(msg, restarts=20, processes=None, seed=0):
+    """
+    msg is a string, the ciphertext to solve (non letters are ignored)
+    restarts is the number of hill climbs from different random keys
+    processes is the number of worker processes to run them on
+    (default: one per cpu, 1 runs them in this process)
+    seed is the seed of the first climb, the others use seed+1, seed+2...
+
+    returns a tuple (score, key, plaintext) for the best climb, where key is
+    the decryption key as a string (see dec_to_key) and plaintext is msg
+    decrypted with it, in upper case
+    """
+    cvals = encode_letters(msg)
+    if len(cvals) < 4:
+        raise ValueError("need at least 4 letters of ciphertext")
+
+    table = get_quadgram_table()   # before the fork, so workers share it
+    index = get_text_index(cvals)  # likewise
+    seeds = range(seed, seed+restarts)
+
+    if processes == 1:
+        results = [hill_climb(cvals, s, table, index) for s in seeds]
+    else:
+        with Pool(processes) as pool:
+            results = pool.map(partial(hill_climb, cvals), seeds)
+
+    score, dec = max(results)
+    key = dec_to_key(dec)
+    return (score, key, SubstitutionKey.from_string(key, lower=False).apply(msg.upper()))
+
+## BATCH SOLVING
+
+def solve_items(items, run, wave, agree, max_restarts, seed):
+    """
+    the body of solve_batch, with run(f, seeds) doing the climbs either in 
+    this process or on a pool
+    """
+    for msgid, msg in items:
+        cvals = encode_letters(msg)
+        if len(cvals) < 4:
+            yield {"id": msgid, "error": "need at least 4 letters of ciphertext"}
+            continue
+
+        ## indexed once here, and once in each worker that climbs it, 
+        ## rather than for every climb (see get_text_index)
+        get_text_index(cvals)
+
+        best = None   # (score, dec, plaintext letter indexes)
+        hits = 0      # number of climbs that reached the best plaintext
+        restarts = 0
+        while hits < agree and restarts < max_restarts:
+            seeds = range(seed+restarts, seed+min(restarts+wave, max_restarts))
+            for score, dec in run(partial(hill_climb, cvals), seeds):
+                ## letters not in the ciphertext can map anywhere, 
+                ## so climbs agree if they give the same plaintext
+                pvals = cvals.translate(bytes(dec) + bytes(230))
+                if best is None or score > best[0]:
+                    best = (score, dec, pvals)
+                    hits = 1
+                elif pvals == best[2]:
+                    hits += 1
+            restarts += len(seeds)
+
+        score, dec, pvals = best
+        key = dec_to_key(dec)
+        yield {"id": msgid,
+               "key": key,
+               "score": score,
+               "restarts": restarts,
+               "agreed": hits >= agree,
+               "plaintext": SubstitutionKey.from_string(key, lower=False).apply(msg.upper())}
+
+def solve_batch(items, processes=None, wave=None, agree=3, max_restarts=60, seed=0):
+    """
+    items is an iterable of tuples (id, ciphertext), where ciphertext is a 
+    string encrypted with a monoalphabetic substitution
+    processes is the number of worker processes to climb on
+    (default: one per cpu, 1 climbs in this process)
+    wave is the number of climbs run at once for a text 
+    (default: one per worker process)
+    agree is the number of climbs that must reach the best plaintext 
+    before a text is taken as solved
+    max_restarts is the most climbs to make for one text
+    seed is the seed of the first climb for each text
+
+    the texts are taken in turn. each gets waves of hill climbs from random 
+    keys until agree of them reach the same best plaintext, or max_restarts 
+    is used up.
+
+    a generator, it yields a dictionary with the id, key (see dec_to_key), 
+    score, number of restarts, whether the climbs agreed and the plaintext 
+    as soon as each text is done.
+    if the text has fewer than 4 letters, yields the id and an error instead
+    """
+    get_quadgram_table()   # before the fork, so workers share it
+
+    if processes == 1:
+        run = lambda f, seeds: [f(s) for s in seeds]
+        yield from solve_items(items, run, wave or 1, agree, max_restarts, seed)
+    else:
+        with Pool(processes) as pool:
+            wave = wave or processes or os.cpu_count()
+            yield from solve_items(items, pool.map, wave, agree, max_restarts, seed)
 
-    
-   
 
-      
-analyse(CIPHER)
\ No newline at end of file
+if __name__ == "__main__":
+    analyse(CIPHER)
@@ -1,5 +1,11 @@
 # apply vigenere cipher
 
+import time
+from collections import Counter
+from random import choice
+
+from coincidence import match_rates, period_threshold
+
 ## can use <string>.index() function to obtain index of any character in the string
 alphabet = "abcdefghijklmnopqrstuvwxyz"
 
@@ -50,6 +56,226 @@ def encrypt(key, plaintext, mult=1):
 
 
 
+def gen_tables(key, mult=1):
+    """
+    key is a string of lower case letters
+    mult = 1 for encrypting, -1 for decrypting
+
+    returns a list of bytes translation tables, one per key position, 
+    where table i shifts every lower case letter by key[i]*mult
+    """
+    tables = []
+    for c in key:
+        offset = alphabet.index(c)*mult
+        shifted = alphabet[offset%26:] + alphabet[:offset%26]
+        tables.append( bytes.maketrans(alphabet.encode(), shifted.encode()) )
+
+    return tables
+
+LOWER = alphabet.encode()
+
+def apply_tables(tables, data, ikey=0, offset=0):
+    """
+    tables is a list of translation tables, as returned by gen_tables
+    data is a bytes object containing only lower case letters
+    ikey is the index of the table to use for the first byte of data
+    offset is the position of data in the whole text, for error messages
+
+    every byte at position i, i+len(tables), i+2*len(tables)... is shifted 
+    by the same table, so each of those strided slices is translated
+    in one go and written back in place
+
+    returns the translated bytes
+    raises ValueError, giving its position, if a byte of data is not a 
+    lower case letter (the text must be filtered down to a-z first)
+    """
+    good = len(data) - len(data.lstrip(LOWER))   # length of the run of letters
+    if good < len(data):
+        raise ValueError("not a lower case letter at position " + str(offset + good) + 
+                         ": " + repr(data[good:good+1]))
+
+    n = len(tables)
+    out = bytearray(data)
+    for i in range(n):
+        ## table used for byte i of data
+        out[i::n] = data[i::n].translate(tables[(ikey+i)%n])
+
+    return bytes(out)
+
+def encrypt_fast(key, plaintext, mult=1, ikey=0):
+    """
+    key and plaintext are strings
+    we assume they all use only lower case letters of the alphabet
+    ikey is the index of the key letter to start from
+
+    returns the same ciphertext as encrypt(key, plaintext, mult)
+    """
+    tables = gen_tables(key, mult)
+
+    return apply_tables(tables, plaintext.encode('ascii', 'replace'), ikey).decode('ascii')
+
+def encrypt_stream(key, instream, outstream, mult=1, ikey=0, chunksize=2**20):
+    """
+    key is a string of lower case letters
+    instream is a readable text or binary stream of lower case letters
+    outstream is a writable stream of the same kind
+    mult = 1 for encrypting, -1 for decrypting
+    ikey is the index of the key letter to start from
+    chunksize is the number of characters to read at a time
+
+    encrypts instream into outstream one chunk at a time, carrying the key
+    index over from one chunk to the next so the output is the same as 
+    a single call to encrypt
+
+    returns the key index to continue from 
+    raises ValueError at the first character that is not a lower case 
+    letter (see apply_tables). each chunk is checked before any of it is
+    written, but the chunks before it have been written by then, so the
+    stream should be filtered down to a-z first
+    """
+    tables = gen_tables(key, mult)
+    pos = 0   # position of chunk in instream
+
+    while True:
+        chunk = instream.read(chunksize)
+        if not chunk:
+            break
+
+        if isinstance(chunk, str):
+            data = apply_tables(tables, chunk.encode('ascii', 'replace'), ikey, pos)
+            outstream.write( data.decode('ascii') )
+        else:
+            outstream.write( apply_tables(tables, chunk, ikey, pos) )
+
+        ikey = (ikey + len(chunk)) % len(tables)  #key index for next chunk
+        pos += len(chunk)
+
+    return ikey
+
+## probability that two letters picked at random match, for english text
+## and for uniformly random letters
+ENG_IOC = 0.0667
+RANDOM_IOC = 1/26
+
+def lag_coincidence_rates(ciphertext, max_key_len=20):
+    """
+    ciphertext is a string of letters
+    max_key_len is an int, the largest key length to consider
+
+    for each lag p from 1 to max_key_len computes the fraction of positions 
+    i where ciphertext[i] == ciphertext[i+p]. if p is a multiple of the 
+    key length, both letters were shifted by the same key letter and the
+    rate is close to ENG_IOC, otherwise it is close to RANDOM_IOC
+
+    NB this is a lag coincidence rate, not the index of coincidence of the 
+    p columns ciphertext[r::p]. the two have the same expected value, but
+    the lag rate only compares letters exactly p apart, so it is noisier 
+    on short texts. lags below coincidence.MIN_LAG, where neighbouring 
+    english letters are not independent, get the index of coincidence of 
+    the columns instead (see coincidence.match_rates)
+
+    returns a list of rates, where the rate for lag p is at index p-1
+    """
+    return match_rates(ciphertext.lower().encode('ascii'), max_key_len)
+
+def kasiski_votes(ciphertext, max_key_len=20, limit=200000):
+    """
+    ciphertext is a string of letters
+    max_key_len is an int, the largest key length to consider
+    limit is the number of letters from the start of ciphertext to examine
+
+    finds every repeated trigram and the spacing from its previous occurrence.
+    repeats are usually the same plaintext encrypted at the same key position, 
+    so the key length divides most of the spacings
+
+    returns a list of vote counts, where the count at index p-1 is the number 
+    of spacings that are a multiple of p
+    """
+    data = ciphertext[:limit].lower()
+
+    last_seen = {}
+    spacings = Counter()
+    for i in range(len(data)-2):
+        trigram = data[i:i+3]
+        if trigram in last_seen:
+            spacings[i - last_seen[trigram]] += 1
+        last_seen[trigram] = i
+
+    votes = []
+    for p in range(1, max_key_len+1):
+        votes.append( sum(cnt for d, cnt in spacings.items() if d%p == 0) )
+
+    return votes
+
+def find_key_length(ciphertext, max_key_len=20):
+    """
+    ciphertext is a string of letters encrypted with a vigenere key
+    max_key_len is an int, the largest key length to consider
+
+    the key length and its multiples are the lags whose lag coincidence 
+    rate reaches coincidence.period_threshold, which divisors of the key 
+    length do not. the smallest of those is the key length (as for 
+    coincidence.best_period), unless noise lifts some other lag that is 
+    not a multiple of it over the threshold too. kasiski votes break such 
+    ties: the key length divides the most spacings of repeated trigrams
+
+    returns a list of (keylen, rate, votes) tuples, most likely key length 
+    first, then its multiples, then the rest by rate
+    """
+    rates = lag_coincidence_rates(ciphertext, max_key_len)
+    votes = kasiski_votes(ciphertext, max_key_len)
+    stats = [(p+1, rates[p], votes[p]) for p in range(max_key_len)]
+
+    threshold = period_threshold(rates, RANDOM_IOC)
+    likely = [s for s in stats if s[1] >= threshold]
+    unlikely = [s for s in stats if s[1] < threshold]
+
+    ## lags that are not multiples of a smaller likely lag
+    roots = [s for s in likely if not any(s[0] % t[0] == 0 for t in likely if t[0] < s[0])]
+    multiples = [s for s in likely if s not in roots]
+
+    roots.sort(key=lambda s:(-s[2], s[0]))
+    unlikely.sort(key=lambda s:s[1], reverse=True)
+
+    return roots + multiples + unlikely
+
+def test_find_key_length(keys=("ab", "crypto", "lemon", "vigenere"), size=50000):
+    """
+    keys are the keys to try
+    size is the number of letters of english plaintext to encrypt
+
+    checks that find_key_length ranks the length of each key first, on 
+    english text from the python docs
+    """
+    from pydoc_data.topics import topics
+    letters = "".join(c for c in " ".join(topics.values()).lower() if c in alphabet)
+    plaintext = letters[:size]
+
+    for key in keys:
+        keylen = find_key_length(encrypt_fast(key, plaintext))[0][0]
+        assert keylen == len(key), (key, keylen)
+
+def bench(size=200000, key="lemon"):
+    """
+    size is an int, the number of characters of plaintext to use
+    key is the string key to encrypt with
+
+    times encrypt against encrypt_fast on the same random plaintext
+    and checks that they agree
+    """
+    plaintext = "".join( choice(alphabet) for i in range(size) )
+
+    t = time.perf_counter()
+    slow = encrypt(key, plaintext)
+    t_slow = time.perf_counter() - t
 
+    t = time.perf_counter()
+    fast = encrypt_fast(key, plaintext)
+    t_fast = time.perf_counter() - t
 
+    assert slow == fast
+    assert encrypt_fast(key, fast, -1) == plaintext
 
+    print("encrypt:      ", round(t_slow, 4), "s")
+    print("encrypt_fast: ", round(t_fast, 4), "s")
+    print("speedup:      ", round(t_slow/t_fast, 1), "x")
@@ -3,6 +3,8 @@
 # then ciphertext XOR key = plaintext
 # ie you get the plaintext back by reapplying XoR by the same key
 
+from ngram_model import UNSORTED_ENG_FREQ
+
 keys = [0x00, 0x00]  
 
 ## in python, ord(c) will give you the integer value of a single character
@@ -80,17 +82,6 @@ def decrypt(keys, ciphertext):
 ### The key length is between 1 and 13
 ciph = "F96DE8C227A259C87EE1DA2AED57C93FE5DA36ED4EC87EF2C63AAE5B9A7EFFD673BE4ACF7BE8923CAB1ECE7AF2DA3DA44FCF7AE29235A24C963FF0DF3CA3599A70E5DA36BF1ECE77F8DC34BE129A6CF4D126BF5B9A7CFEDF3EB850D37CF0C63AA2509A76FF9227A55B9A6FE3D720A850D97AB1DD35ED5FCE6BF0D138A84CC931B1F121B44ECE70F6C032BD56C33FF9D320ED5CDF7AFF9226BE5BDE3FF7DD21ED56CF71F5C036A94D963FF8D473A351CE3FE5DA3CB84DDB71F5C17FED51DC3FE8D732BF4D963FF3C727ED4AC87EF5DB27A451D47EFD9230BF47CA6BFEC12ABE4ADF72E29224A84CDF3FF5D720A459D47AF59232A35A9A7AE7D33FB85FCE7AF5923AA31EDB3FF7D33ABF52C33FF0D673A551D93FFCD33DA35BC831B1F43CBF1EDF67F0DF23A15B963FE5DA36ED68D378F4DC36BF5B9A7AFFD121B44ECE76FEDC73BE5DD27AFCD773BA5FC93FE5DA3CB859D26BB1C63CED5CDF3FE2D730B84CDF3FF7DD21ED5ADF7CF0D636BE1EDB79E5D721ED57CE3FE6D320ED57D469F4DC27A85A963FF3C727ED49DF3FFFDD24ED55D470E69E73AC50DE3FE5DA3ABE1EDF67F4C030A44DDF3FF5D73EA250C96BE3D327A84D963FE5DA32B91ED36BB1D132A31ED87AB1D021A255DF71B1C436BF479A7AF0C13AA14794"
 
-## unsorted english letter frequencies expressed as 
-## percentages
-
-UNSORTED_ENG_FREQ = [('A', 8.55), ('B', 1.60), ('C',3.16), ('D', 3.87), ('E', 12.1),
-            ('F', 2.18), ('G', 2.09), ('H', 4.96), ('I', 7.33), 
-            ('J', 0.22), ('K', 0.81), ('L', 4.21), ('M', 2.53),
-            ('N', 7.17), ('O',7.47), ('P',2.07), ('Q', 0.10),
-            ('R', 6.33), ('S', 6.73), ('T', 8.94), ('U', 2.68),
-            ('V', 1.06), ('W', 1.83), ('X',0.19), ('Y',1.72), ('Z', 0.11)
-            ]
-
 ## Just the percentages, sorted descending
 DISTRIBUTION = sorted([item[1] for item in UNSORTED_ENG_FREQ], reverse=True)
 